@@ -0,0 +1,161 @@
+import pygame
+import threading
+
+
+class AssetRegistry:
+    """Keeps track of every asset declared in config so they can be loaded on first
+    use, preloaded in the background for an upcoming screen, and converted to the
+    display's pixel format once a display exists.
+    """
+
+    def __init__(self):
+        self.assets = []
+        self.by_name = {}
+        self.lock = threading.RLock()
+        self.display_ready = False
+        self.loads = 0
+
+
+    def register(self, asset):
+        self.assets.append(asset)
+
+
+    def get(self, name):
+        """The asset declared as `name` in config, e.g. 'assets.background.level1'."""
+        return self.by_name[name]
+
+
+    def loaded(self):
+        return [asset for asset in self.assets if asset.value is not None]
+
+
+    def for_screen(self, screen):
+        return [asset for asset in self.assets if screen in asset.screens]
+
+
+    def preload(self, screen):
+        """Decodes the assets used by `screen` on a background thread.
+        Returns the thread, or None if everything is already loaded."""
+        pending = [asset for asset in self.for_screen(screen) if asset.value is None and asset.raw is None]
+        if not pending: return None
+
+        thread = threading.Thread(target=self.__decode_all__, args=(pending,), daemon=True)
+        thread.start()
+        return thread
+
+
+    def __decode_all__(self, assets):
+        for asset in assets:
+            asset.decode_in_background()
+
+
+    def enable_conversion(self):
+        """Called once a display exists. Converts what is already loaded and makes
+        every later load convert too."""
+        with self.lock:
+            self.display_ready = True
+            for asset in self.assets:
+                if asset.value is not None:
+                    asset.value = asset.prepare(asset.value)
+
+
+registry = AssetRegistry()
+
+
+class Asset:
+    """A resource on disk that is only loaded the first time it is read.
+
+    Declared as a class attribute in config, e.g. `img = ImageAsset('resources/x.png')`;
+    reading `config.some.img` returns the loaded resource. `screens` lists the
+    screens the asset is used on so it can be preloaded ahead of them.
+    """
+
+    def __init__(self, path, screens=()):
+        self.path = path
+        self.screens = screens
+        self.name = path
+        self.raw = None  # decoded by a background preload but not yet prepared
+        self.value = None
+        registry.register(self)
+
+
+    def __set_name__(self, owner, name):
+        self.name = f'{owner.__qualname__}.{name}'
+        registry.by_name[self.name] = self
+
+
+    def __get__(self, instance, owner):
+        value = self.value
+        if value is None:
+            value = self.load()
+        return value
+
+
+    def __repr__(self):
+        state = 'loaded' if self.value is not None else 'not loaded'
+        return f'{type(self).__name__}({self.name}, {state})'
+
+
+    def load(self):
+        with registry.lock:
+            if self.value is None:
+                raw = self.raw if self.raw is not None else self.decode()
+                self.value = self.prepare(raw)
+                self.raw = None
+                registry.loads += 1
+        return self.value
+
+
+    def decode_in_background(self):
+        raw = self.decode()
+        with registry.lock:
+            if self.value is None and self.raw is None:
+                self.raw = raw
+
+
+    def decode(self):
+        raise NotImplementedError
+
+
+    def prepare(self, raw):
+        """Turns a decoded resource into the value handed out. Runs on the main thread."""
+        return raw
+
+
+class ImageAsset(Asset):
+    def decode(self):
+        return pygame.image.load(self.path)
+
+
+    def prepare(self, raw):
+        if not registry.display_ready:
+            return raw
+        if raw.get_flags() & pygame.SRCALPHA:
+            return raw.convert_alpha()
+        return raw.convert()
+
+
+class ImageListAsset(Asset):
+    """Several images read together as a list, like the enemy bullet variants."""
+
+    def __init__(self, paths, screens=()):
+        self.images = [ImageAsset(path, screens) for path in paths]
+        super().__init__(tuple(paths), screens)
+
+
+    def decode(self):
+        return None
+
+
+    def decode_in_background(self):
+        for image in self.images:
+            image.decode_in_background()
+
+
+    def prepare(self, raw):
+        return [image.load() for image in self.images]
+
+
+class SoundAsset(Asset):
+    def decode(self):
+        return pygame.mixer.Sound(self.path)
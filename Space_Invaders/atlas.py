@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import pygame
+import config
+from asset_registry import ImageListAsset, registry as asset_registry
+from util_objects import *
+from meta import create_logger
+
+
+log = create_logger('atlas')
+
+
+# Bump when the cache layout changes so old caches are rebuilt.
+CACHE_VERSION = 2
+# Sprites start on, and rows of the atlas are a multiple of, this many pixels (16
+# bytes). SDL's SIMD alpha blitters slow down a lot on unaligned source rows.
+ALIGN = 4
+
+
+class SpriteAtlas:
+    """The gameplay sprites packed, at the sizes they're drawn at, into one surface.
+
+    `sprites` maps asset names from config (e.g. 'enemy.frigate.img') to the size
+    they are drawn at. An ImageListAsset packs each of its images, named
+    'game.bullet_enemy_img[0]' and so on. SpriteCache asks the atlas first, so
+    drawables of those assets draw a subsurface of the atlas instead of a surface of
+    their own.
+
+    Packing scales every sprite, so the packed surface and its index are saved in
+    `cache_dir` and reused as long as none of the source files or sizes change.
+    """
+
+    def __init__(self, sprites, cache_dir, max_width=512, padding=1):
+        self.assets = {}  # packed name -> ImageAsset
+        self.sizes = {}  # packed name -> (width, height)
+        for name, size in sprites.items():
+            if isinstance(size, Coord):
+                size = size.as_tuple
+            size = (int(size[0]), int(size[1]))
+            asset = asset_registry.get(name)
+            if isinstance(asset, ImageListAsset):
+                for i, image in enumerate(asset.images):
+                    self.assets[f'{name}[{i}]'] = image
+                    self.sizes[f'{name}[{i}]'] = size
+            else:
+                self.assets[name] = asset
+                self.sizes[name] = size
+
+        self.cache_dir = cache_dir
+        self.max_width = max_width
+        self.padding = padding
+        self.surface = None
+        self.rects = {}  # packed name -> (x, y, width, height) in self.surface
+        self.found = {}  # (id(source), size) -> (source, atlas subsurface or None)
+
+
+    @staticmethod
+    def create():
+        """The atlas described by config.atlas, or None if it's turned off."""
+        if not config.atlas.enabled:
+            return None
+        return SpriteAtlas(config.atlas.sprites, config.atlas.cache_dir, config.atlas.max_width, config.atlas.padding)
+
+
+    def find(self, surface, size):
+        """The atlas sprite for `surface` drawn at `size`, or None if it isn't packed.
+        The atlas is loaded or packed the first time one of its sprites is asked for."""
+        key = (id(surface), size)
+        found = self.found.get(key)
+        if found is not None and found[0] is surface:
+            return found[1]
+
+        sprite = None
+        for name, asset in self.assets.items():
+            if asset.value is surface and self.sizes[name] == size:
+                if self.surface is None:
+                    self.build()
+                sprite = self.surface.subsurface(self.rects[name])
+                break
+        # Kept even when it isn't packed so backgrounds and menus only look once.
+        self.found[key] = (surface, sprite)
+        return sprite
+
+
+    def forget(self):
+        """Drops the sprites handed out, e.g. after prepare_assets replaced the sources."""
+        self.found.clear()
+        self.surface = None
+
+
+    def cache_key(self):
+        """Changes whenever a source file, a size or the packing settings change."""
+        sources = []
+        for name, asset in sorted(self.assets.items()):
+            stat = os.stat(asset.path)
+            sources.append([name, asset.path, stat.st_mtime_ns, stat.st_size, self.sizes[name]])
+        description = json.dumps([CACHE_VERSION, self.max_width, self.padding, sources])
+        return hashlib.sha1(description.encode()).hexdigest()
+
+
+    def build(self):
+        key = self.cache_key()
+        image_path = os.path.join(self.cache_dir, 'sprites.png')
+        index_path = os.path.join(self.cache_dir, 'sprites.json')
+
+        surface = None
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if index['key'] == key:
+                surface = pygame.image.load(image_path)
+                self.rects = {name: tuple(rect) for name, rect in index['rects'].items()}
+                log.debug(f'Loaded {len(self.rects)} sprites from {image_path}')
+        except (OSError, ValueError, KeyError, pygame.error):
+            surface = None
+
+        if surface is None:
+            surface = self.pack()
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                pygame.image.save(surface, image_path)
+                with open(index_path, 'w') as f:
+                    json.dump({'key': key, 'rects': self.rects}, f)
+            except (OSError, pygame.error) as e:
+                log.warning(f'Could not cache the sprite atlas in {self.cache_dir}: {e}')
+
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        self.surface = surface
+
+
+    def pack(self):
+        """Scales every sprite and packs them in shelves, tallest first."""
+        padding = self.padding
+        align = lambda value: -(-value // ALIGN) * ALIGN
+        names = sorted(self.sizes, key=lambda name: (-self.sizes[name][1], name))
+        self.rects = {}
+        x = y = shelf_height = width = 0
+        for name in names:
+            w, h = self.sizes[name]
+            if x > 0 and x + w > self.max_width:
+                x = 0
+                y += shelf_height + padding
+                shelf_height = 0
+            self.rects[name] = (x, y, w, h)
+            width = max(width, x + w)
+            x = align(x + w + padding)
+            shelf_height = max(shelf_height, h)
+
+        surface = pygame.Surface((align(max(1, width)), max(1, y + shelf_height)), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 0))
+        for name, rect in self.rects.items():
+            # Max against the transparent fill copies the pixels instead of blending them.
+            sprite = pygame.transform.scale(self.assets[name].load(), rect[2:])
+            surface.blit(sprite, rect[:2], special_flags=pygame.BLEND_RGBA_MAX)
+        log.debug(f'Packed {len(self.rects)} sprites into a {surface.get_width()}x{surface.get_height()} atlas')
+        return surface
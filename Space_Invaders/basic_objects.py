@@ -1,17 +1,29 @@
 import pygame
 import config
+from math import ceil
+from asset_registry import registry as asset_registry
 from util_objects import *
-from meta import create_logger
+from meta import create_logger, create_hot_logger
 
 
 log = create_logger('basic_objects')
+hot_log = create_hot_logger('basic_objects', log)
 
 
 class Clock:
+    """Paces frames to a target framerate and keeps a history of frame times.
+
+    Sleeping is only accurate to a few milliseconds on a loaded host, so tick()
+    sleeps until `config.window.spin_wait` seconds before the deadline and
+    busy-waits the rest. Deadlines follow on from each other rather than from when
+    the last frame happened to finish, so small overshoots don't add up.
+    """
+
     def __init__(self):
         self.start = time()
-        self.previous_ticks = DroppingStack(config.window.fps_history)
-        self.previous_ticks.put(self.start)
+        self.last_tick = self.start
+        self.next_frame = None
+        self.frame_times = RingBuffer(config.window.fps_history)
         self.ticks_since_start = 0
 
 
@@ -20,29 +32,41 @@ class Clock:
 
 
     def tick(self, framerate=None):
-        cur_tick = time()
         if framerate is not None:
-            delay = cur_tick - self.previous_ticks.arr[-1]
-            delay = (1 / framerate) - delay
+            frame_length = 1 / framerate
+            if self.next_frame is None or self.next_frame < time() - frame_length:
+                # First frame, or too far behind to keep the old schedule.
+                self.next_frame = self.last_tick + frame_length
+            delay = self.next_frame - time()
             if delay > 0.0:
-                log.debug(f"Delaying frame by {round(delay,4)} seconds")
-                sleep(delay)
-        self.previous_ticks.put(time())
+                if hot_log.enabled: hot_log.debug(f"Delaying frame by {round(delay,4)} seconds")
+                self.wait_until(self.next_frame)
+            self.next_frame += frame_length
+
+        cur_tick = time()
+        self.frame_times.put(cur_tick - self.last_tick)
+        self.last_tick = cur_tick
         self.ticks_since_start += 1
 
 
+    def wait_until(self, deadline):
+        coarse = deadline - time() - config.window.spin_wait
+        if coarse > 0.0:
+            sleep(coarse)
+        while time() < deadline:
+            pass
+
+
     def avg_frame_time(self):
-        avg_time = 0
-        if len(self.previous_ticks.arr) == 0:
-            return avg_time
+        return self.frame_times.mean()
+
 
-        for i in range(len(self.previous_ticks.arr)-1, 0, -1):
-            avg_time += self.previous_ticks.arr[i] - self.previous_ticks.arr[i-1]
+    def max_frame_time(self):
+        return self.frame_times.max()
 
-        if len(self.previous_ticks.arr) > 1:
-            avg_time /= len(self.previous_ticks.arr)-1
 
-        return avg_time
+    def frame_time_percentile(self, fraction):
+        return self.frame_times.percentile(fraction)
 
 
     def get_fps(self):
@@ -53,7 +77,152 @@ class Clock:
             return 1 / avg_frame_time
 
 
+class SpriteCache(LRUCache):
+    """Shares scaled sprite surfaces between every object drawn at the same size.
+
+    Entries are keyed by (source surface, size, flags) and the least recently used
+    entry is dropped once `max_size` entries are cached. The cached surfaces are
+    shared, so they must never be drawn onto. Sprites packed in `atlas`, an
+    atlas.SpriteAtlas, are handed out from it instead.
+    """
+
+    def __init__(self, max_size):
+        super().__init__(max_size)
+        self.atlas = None
+
+
+    def scale(self, surface, size, smooth=False):
+        if isinstance(size, Coord):
+            size = size.as_tuple
+        size = (int(size[0]), int(size[1]))
+        if surface.get_size() == size:
+            return surface
+        if self.atlas is not None and not smooth:
+            sprite = self.atlas.find(surface, size)
+            if sprite is not None:
+                return sprite
+
+        key = (id(surface), size, smooth)
+        scaled = self.get(key, surface)
+        if scaled is not None:
+            return scaled
+
+        if smooth:
+            scaled = pygame.transform.smoothscale(surface, size)
+        else:
+            scaled = pygame.transform.scale(surface, size)
+        return self.put(key, scaled, surface)
+
+
+sprite_cache = SpriteCache(config.game.sprite_cache_size)
+
+
+class MaskCache(LRUCache):
+    """Collision masks of sprite surfaces, built the first time a surface collides.
+
+    Drawables share their scaled surfaces through sprite_cache, so keying on the
+    surface gives one mask per sprite and size. The least recently used entry is
+    dropped past `max_size`.
+    """
+
+    def mask(self, surface):
+        mask = self.get(id(surface), surface)
+        if mask is not None:
+            return mask
+        return self.put(id(surface), pygame.mask.from_surface(surface), surface)
+
+
+mask_cache = MaskCache(config.game.mask_cache_size)
+
+
+class TextCache(LRUCache):
+    """Rendered text surfaces keyed by (font, string, antialias, colour) so a string is
+    only run through FreeType the first time it is drawn. Least recently used entries
+    are dropped past `max_size`."""
+
+    def render(self, font, string, antialias, colour):
+        key = (font, string, antialias, colour)
+        surface = self.get(key)
+        if surface is not None:
+            return surface
+        return self.put(key, font.render(string, antialias, colour))
+
+
+text_cache = TextCache(config.window.text_cache_size)
+
+
+class GlyphAtlas:
+    """Pre-rendered glyphs of one font and colour. Strings made only of those
+    characters, like the score, are composed by blitting glyphs instead of being
+    rendered by FreeType."""
+
+    def __init__(self, font, antialias, colour, characters='0123456789-'):
+        self.glyphs = {c: font.render(c, antialias, colour) for c in characters}
+        self.height = max(glyph.get_height() for glyph in self.glyphs.values())
+
+
+    def can_render(self, string):
+        return len(string) > 0 and all(c in self.glyphs for c in string)
+
+
+    def render(self, string):
+        glyphs = [self.glyphs[c] for c in string]
+        surface = pygame.Surface((sum(glyph.get_width() for glyph in glyphs), self.height), pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            surface.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return surface
+
+
+glyph_atlases = {}
+
+
+def glyph_atlas(font, antialias, colour):
+    """The shared GlyphAtlas for a font, antialias setting and colour."""
+    key = (font, antialias, colour)
+    atlas = glyph_atlases.get(key)
+    if atlas is None:
+        atlas = glyph_atlases[key] = GlyphAtlas(font, antialias, colour)
+    return atlas
+
+
+def convert_surface(surface):
+    """Returns a copy of surface in the display's pixel format, keeping per-pixel alpha."""
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+    return surface.convert()
+
+
+def prepare_assets(drawables=()):
+    """Converts the assets loaded so far and the given drawables to the display's
+    pixel format so blits don't convert pixels every frame, and drops the sprites
+    scaled from the old surfaces. Assets that haven't been loaded yet are converted
+    by the asset registry when they are first used.
+    Needs a display to exist, call it after `pygame.display.set_mode`.
+    """
+    asset_registry.enable_conversion()
+    converted = len(asset_registry.loaded())
+
+    # Cached sprites were scaled from the old surfaces, so drop them rather than keep stale keys.
+    sprite_cache.clear()
+    mask_cache.clear()
+    if sprite_cache.atlas is not None:
+        sprite_cache.atlas.forget()
+
+    for drawable in drawables:
+        if drawable.img is not None:
+            drawable.img = convert_surface(drawable.img)
+            converted += 1
+
+    log.debug(f'Converted {converted} surfaces to the display format')
+    return converted
+
+
 class Drawable(Rect):
+    # Where this is drawn in the back to front order, see renderer.draw_in_order.
+    layer = Layer.UI
+
     def __init__(self, *, game,
                  img=None,
                  position=Coord(0,0),
@@ -61,14 +230,15 @@ class Drawable(Rect):
                  visible=True,
                  valid_screens=None):
         self.game = game
-        self.game.drawables.append(self)
+        self.game.drawables.add(self)
 
         self.visible = visible
         if img is not None:
-            self.img = pygame.transform.scale(img, size.as_tuple)
+            self.img = sprite_cache.scale(img, size)
         else:
             self.img = img
         self.valid_screens = valid_screens
+        self.game.screen_drawables.add(self)
 
         if isinstance(position, Coord):
             position = position.as_tuple
@@ -107,7 +277,7 @@ class Drawable(Rect):
         self.height = new_size[1]
         self._size = Coord(*new_size)
         if self.img is not None:
-            self.img = pygame.transform.scale(self.img, new_size)
+            self.img = sprite_cache.scale(self.img, new_size)
 
 
     @property
@@ -124,22 +294,48 @@ class Drawable(Rect):
         self.right = new_position[1]
 
 
+    def attach(self):
+        """Adds a detached object back to the game, see game_objects.BulletPool."""
+        self.game.drawables.add(self)
+        self.game.screen_drawables.add(self)
+
+
+    def detach(self):
+        """Removes this from the game, but leaves it usable so it can be attached again."""
+        self.game.drawables.remove(self)
+        self.game.screen_drawables.remove(self)
+
+
     def delete(self):
-        if self in self.game.drawables: self.game.drawables.remove(self)
+        self.detach()
+
+
+    def draw_position(self):
+        """Where the top left corner is drawn this frame."""
+        return (self.x, self.y)
+
+
+    def render_state(self):
+        """The screen rect this draws to and a token that changes whenever its pixels
+        would. Returns None if that can't be known, forcing a full redraw."""
+        return ((*self.draw_position(), self.width, self.height), self.img)
+
+
+    def blit_item(self):
+        """The (surface, position) pair this is drawn as, so renderers can hand many
+        drawables to a single Surface.blits call. None if it has to be drawn by __draw__."""
+        if self.img is None: return None
+        return (self.img, self.draw_position())
 
 
     def __draw__(self, screen):
+        """Only called for drawables valid on the current screen, see Game.screen_drawables."""
         if not self.visible: return False
-        if self.valid_screens is not None:
-            if isinstance(self.valid_screens, Screen):
-                if self.game.current_screen != self.valid_screens: return False
-            elif isinstance(self.valid_screens, tuple):
-                if self.game.current_screen not in self.valid_screens: return False
 
         if self.img is None:
-            pygame.draw.rect(screen, config.game.default_rect_colour, pygame.Rect(*self.position.as_tuple, *self.size.as_tuple))
+            pygame.draw.rect(screen, config.game.default_rect_colour, pygame.Rect(*self.draw_position(), *self.size.as_tuple))
         else:
-            screen.blit(self.img, self)
+            screen.blit(self.img, self.draw_position())
         return True
 
 
@@ -153,8 +349,19 @@ class Clickable(Drawable):
 
 
 class Simulatable(Drawable):
+    # Whether the EntityStore can move and collide this in bulk, for objects that fly in
+    # a straight line like bullets. Bouncing objects are never stored.
+    bulk_simulated = False
+    # The EntityStore or EnemyFormation that moves this each tick, None if it moves itself.
+    mover = None
+    # Which objects this collides with, see config.game.collision_matrix.
+    collision_layer = CollisionLayer.Other
+    # Collide with everything passed on the way from the last tick's position, not only
+    # where this ends up, so fast objects can't tunnel through thin ones.
+    swept = False
+
     def __init__(self, *, game,
-                 velocity=Velocity(scalar=0, degrees=0),
+                 velocity=None,
                  simulating=True,
                  bounce_screen_edges=True,
                  collide=True,
@@ -169,11 +376,12 @@ class Simulatable(Drawable):
             - collide : Whether or not to collide with other collidable objects and to call the collide_callback.
         """
         self.game = game
-        self.game.simulatables.append(self)
 
         self.name = name
         self.sound = sound
 
+        if velocity is None:
+            velocity = CartesianVelocity()
         self.velocity = velocity
 
         self.simulating = simulating
@@ -182,6 +390,26 @@ class Simulatable(Drawable):
 
         super().__init__(game=game, **kwargs)
 
+        # Position before the latest tick, used to interpolate drawing between ticks.
+        self.last_x = self.x
+        self.last_y = self.y
+
+        self.entity = None
+        self.__add_to_simulation__()
+
+
+    def __add_to_simulation__(self):
+        self.game.simulatables.add(self)
+        if (self.bulk_simulated and not self.bounce_screen_edges and self.mover is None
+                and self.game.entity_store is not None):
+            # Stored objects stay out of the simulate loop and the collision grid, see Game.simulate.
+            self.game.entity_store.add(self)
+            return
+
+        self.game.screen_simulatables.add(self)
+        if self in self.game.screen_simulatables:
+            self.game.collision_grid.insert(self)
+
 
     def __eq__(self, other):
         if not isinstance(other, Simulatable): return False
@@ -202,10 +430,26 @@ class Simulatable(Drawable):
             return super().__str__()
 
 
-    def delete(self):
-        if self in self.game.simulatables:
-            self.game.simulatables.remove(self)
-        super().delete()
+    def attach(self):
+        super().attach()
+        self.__add_to_simulation__()
+
+
+    def detach(self):
+        self.game.simulatables.remove(self)
+        self.game.screen_simulatables.remove(self)
+        self.game.collision_grid.remove(self)
+        if self.entity is not None:
+            self.game.entity_store.remove(self)
+        super().detach()
+
+
+    def draw_position(self):
+        alpha = self.game.interpolation
+        if alpha is None:
+            return (self.x, self.y)
+        return (round(self.last_x + (self.x - self.last_x) * alpha),
+                round(self.last_y + (self.y - self.last_y) * alpha))
 
 
     def __move_object_with_velocity__(self):
@@ -216,20 +460,27 @@ class Simulatable(Drawable):
     def __isimulate__(self):
         """Simulates movement and collisions by modifying self.
         Returns False if nothing was simulated, True if any simulation occurred.
+        Only called for simulatables valid on the current screen.
         """
         if not self.simulating: return False
-        if self.valid_screens is not None:
-            if isinstance(self.valid_screens, Screen):
-                if self.game.current_screen != self.valid_screens: return False
-            elif isinstance(self.valid_screens, tuple):
-                if self.game.current_screen not in self.valid_screens: return False
-
-        self.__move_object_with_velocity__()
-
-        if self.bounce_screen_edges:
-            self.__bounce_screen_edges__()
-
+        profiler = self.game.profiler
+        timed = profiler.enabled
+        if timed: start = time()
+
+        # Objects with a mover were already moved and bounced this tick.
+        if self.mover is None:
+            self.last_x = self.x
+            self.last_y = self.y
+            self.__move_object_with_velocity__()
+            if timed: start = profiler.lap('movement', start)
+
+            if self.bounce_screen_edges:
+                self.__bounce_screen_edges__()
+            if timed: start = profiler.lap('bounce', start)
+
+        self.game.collision_grid.update(self)
         self.__detect_collisions_with_objects__()
+        if timed: profiler.lap('collision', start)
 
         return True
 
@@ -250,11 +501,71 @@ class Simulatable(Drawable):
             obj.collide_callback(self)
 
 
+    def collision_mask(self):
+        """The opaque pixels of this object's sprite, None to collide as a solid rect."""
+        if self.img is None: return None
+        return mask_cache.mask(self.img)
+
+
     def __detect_collisions_with_objects__(self):
-        for obj in self.game.collidable_objects():
-            if obj == self: continue
-            if self.colliderect(obj):
-                self.__collide_object__(obj)
+        """Only objects on a layer self collides with and sharing a broadphase cell with it
+        reach `colliderect`, and only overlapping rects have their masks compared."""
+        if self.swept and (self.x != self.last_x or self.y != self.last_y):
+            self.__detect_swept_collisions__()
+            return
+
+        grid = self.game.collision_grid
+        pixel_perfect = config.game.pixel_perfect_collisions
+        for obj in grid.nearby(self):
+            if obj is self: continue
+            # An earlier callback this frame may have deleted the candidate.
+            if obj not in grid: continue
+            if not self.colliderect(obj): continue
+            if pixel_perfect and not masks_overlap(self, self.collision_mask(), obj, obj.collision_mask()):
+                continue
+            self.__collide_object__(obj)
+
+
+    def __detect_swept_collisions__(self):
+        """Collides with the objects self moved through this tick, nearest first, and
+        stops once a collision removes self. The objects hit are taken as standing still."""
+        grid = self.game.collision_grid
+        pixel_perfect = config.game.pixel_perfect_collisions
+        start = Rect(self.last_x, self.last_y, self.width, self.height)
+        dx = self.x - self.last_x
+        dy = self.y - self.last_y
+
+        hits = []
+        for obj in grid.nearby(self, start.union(self)):
+            if obj is self: continue
+            if obj not in grid: continue
+            times = swept_aabb(start, dx, dy, obj)
+            if times is None: continue
+            if pixel_perfect and not self.__swept_masks_overlap__(start, dx, dy, obj, times): continue
+            hits.append((times[0], obj))
+
+        hits.sort(key=lambda hit: hit[0])
+        simulatables = self.game.simulatables
+        for entry, obj in hits:
+            if self not in simulatables: break
+            if obj not in grid: continue
+            self.__collide_object__(obj)
+
+
+    def __swept_masks_overlap__(self, start, dx, dy, obj, times):
+        """Compares the masks about a pixel apart along the part of the move where the rects overlap."""
+        mask = self.collision_mask()
+        other_mask = obj.collision_mask()
+        entry, exit = times
+        steps = max(1, ceil(max(abs(dx), abs(dy)) * (exit - entry)))
+        at = Rect(start.x, start.y, start.width, start.height)
+        for step in range(1, steps + 1):
+            t = entry + (exit - entry) * step / steps
+            at.x = round(start.x + dx * t)
+            at.y = round(start.y + dy * t)
+            if masks_overlap(at, mask, obj, other_mask):
+                return True
+        return False
 
 
     def hit_by_bullet(self, bullet):
@@ -264,8 +575,8 @@ class Simulatable(Drawable):
 
 
     def screen_edge_callback(self, side_bounced_off):
-        log.debug(f'I ({self}) bounced off the {side_bounced_off} side.')
+        if hot_log.enabled: hot_log.debug(f'I ({self}) bounced off the {side_bounced_off} side.')
 
 
     def collide_callback(self, obj):
-        log.debug(f'I ({self} collided with {obj}.')
+        if hot_log.enabled: hot_log.debug(f'I ({self} collided with {obj}.')
@@ -0,0 +1,51 @@
+"""Measures the per-frame blit time of a level's sprites before and after the
+surfaces are converted to the display's pixel format.
+
+Run from the Space_Invaders directory:
+    python -m benchmarks.blit_format [frames]
+"""
+import sys
+import pygame
+import config
+from timeit import default_timer as time
+from basic_objects import prepare_assets, sprite_cache
+
+
+def scene():
+    """The surfaces and positions a busy level 3 frame blits."""
+    sprites = [(config.assets.background.level3, (0, 0))]
+    enemy_imgs = [config.enemy.frigate.img, config.enemy.one.img, config.enemy.spaceship.img]
+    for y in range(6):
+        for x in range(8):
+            img = sprite_cache.scale(enemy_imgs[(x + y) % 3], config.game.player_size)
+            sprites.append((img, (x * config.game.grid_size.x + 100, y * config.game.grid_size.y + 20)))
+    for i in range(40):
+        img = config.game.bullet_img if i % 2 else config.game.bullet_enemy_img[i % 3]
+        sprites.append((sprite_cache.scale(img, config.game.player_size), ((i * 97) % 1000, (i * 53) % 700)))
+    sprites.append((sprite_cache.scale(config.game.player_image3, config.game.player_size), (492, 600)))
+    return sprites
+
+
+def time_frames(screen, sprites, frames):
+    start = time()
+    for _ in range(frames):
+        for surface, position in sprites:
+            screen.blit(surface, position)
+    return (time() - start) / frames
+
+
+def main(frames=300):
+    pygame.init()
+    screen = pygame.display.set_mode(config.window.size)
+
+    before = time_frames(screen, scene(), frames)
+    prepare_assets()
+    after = time_frames(screen, scene(), frames)
+
+    print(f'unconverted: {before * 1000:.3f} ms/frame')
+    print(f'converted:   {after * 1000:.3f} ms/frame')
+    print(f'speedup:     {before / after:.2f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,202 @@
+"""Frame-time benchmarks for Game.loop.
+
+Runs scripted scenarios in a headless game and times the three phases of every
+frame (handle_events, simulate and draw) separately. Results are printed as
+percentiles and can be saved as JSON to compare against another commit.
+
+Run from the Space_Invaders directory:
+    python -m benchmarks.frame_time --out results.json
+    python -m benchmarks.frame_time --compare results.json
+    python -m benchmarks.frame_time --entity-store --compare results.json
+"""
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import pygame
+import config
+from datetime import datetime
+from timeit import default_timer as time
+from util_objects import *
+
+
+PHASES = ('handle_events', 'simulate', 'draw')
+
+
+class Scenario:
+    """A named way of filling a fresh game before the timed frames."""
+
+    def __init__(self, name, screen, grid=None, bullets=0):
+        self.name = name
+        self.screen = screen
+        self.grid = grid  # (columns, rows) of Frigates replacing the level's enemies
+        self.bullets = bullets  # number of enemy bullets kept alive every frame
+        self.source = None
+
+
+    def prepare(self, game):
+        from enemies import Frigate
+
+        game.change_screen(self.screen)
+        # Keep the scenario running: no level changes and an invincible player.
+        game.set_timer(game.CHECKLEVEL, 0)
+        game.player.hit_by_bullet = lambda bullet: None
+        game.player.collide_callback = lambda obj: None
+        if self.grid is not None:
+            # Squeeze the grid onto the screen so enemies don't start past the bottom.
+            grid_size = config.game.grid_size
+            config.game.grid_size = Coord(44, 28)
+            game.clear_enemies()
+            game.generate_enemies(self.grid, Frigate, 0)
+            config.game.grid_size = grid_size
+        self.source = next(iter(game.enemies), None)
+
+
+    def before_frame(self, game, frame):
+        from game_objects import Bullet
+
+        missing = self.bullets - len(game.bullets)
+        for i in range(max(0, missing)):
+            x = (frame * 37 + i * 53) % (config.window.size[0] - 40)
+            Bullet(
+                position=Coord(x, 20 + (i * 29) % 600),
+                game=game,
+                velocity=CartesianVelocity(0, 5 + i % 3),
+                source=self.source,
+                img=config.game.bullet_enemy_img[i % 3]
+            )
+
+
+SCENARIOS = {
+    'level1': Scenario('level1', Screen.Level1),
+    'level2': Scenario('level2', Screen.Level2),
+    'level3': Scenario('level3', Screen.Level3),
+    'bullet_storm': Scenario('bullet_storm', Screen.Level3, bullets=300),
+    'grid_20x20': Scenario('grid_20x20', Screen.Level1, grid=(20, 20)),
+}
+
+
+def scripted_inputs(frame):
+    """Sweeps the player left and right while firing."""
+    events = []
+    if frame % 5 == 0:
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE))
+    if frame % 60 == 0:
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_LEFT))
+    elif frame % 60 == 30:
+        events.append(pygame.event.Event(pygame.KEYUP, key=pygame.K_LEFT))
+    return events
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarise(samples):
+    """Milliseconds statistics of a list of durations in seconds."""
+    ordered = sorted(samples)
+    ms = lambda value: round(value * 1000, 4)
+    return {
+        'mean': ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        'p50': ms(percentile(ordered, 0.50)),
+        'p90': ms(percentile(ordered, 0.90)),
+        'p99': ms(percentile(ordered, 0.99)),
+        'max': ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def run_scenario(scenario, frames, warmup):
+    import main
+
+    game = main.Game(headless=True, seed=0)
+    game.setup()
+    scenario.prepare(game)
+
+    timings = {phase: [] for phase in PHASES + ('frame',)}
+    for frame in range(warmup + frames):
+        scenario.before_frame(game, frame)
+        events = scripted_inputs(frame)
+
+        start = time()
+        game.handle_events(events)
+        handled = time()
+        game.simulate()
+        simulated = time()
+        game.draw()
+        drawn = time()
+
+        if frame >= warmup:
+            timings['handle_events'].append(handled - start)
+            timings['simulate'].append(simulated - handled)
+            timings['draw'].append(drawn - simulated)
+            timings['frame'].append(drawn - start)
+
+    result = {phase: summarise(samples) for phase, samples in timings.items()}
+    result['enemies'] = len(game.enemies)
+    result['bullets'] = len(game.bullets)
+    pygame.quit()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    for name, result in results['scenarios'].items():
+        print(f"{name} ({result['enemies']} enemies, {result['bullets']} bullets)")
+        for phase in PHASES + ('frame',):
+            stats = result[phase]
+            line = f"  {phase:<14} p50 {stats['p50']:8.3f}  p90 {stats['p90']:8.3f}  p99 {stats['p99']:8.3f}  max {stats['max']:8.3f} ms"
+            if baseline is not None and name in baseline['scenarios']:
+                old = baseline['scenarios'][name][phase]['p50']
+                if old > 0:
+                    line += f"  ({stats['p50'] / old:5.2f}x p50 vs {baseline.get('commit')})"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=30)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--out', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--entity-store', action='store_true', help='move bullets with the NumPy entity store')
+    args = parser.parse_args(argv)
+    if args.entity_store:
+        config.game.use_entity_store = True
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'frames': args.frames,
+        'config': {
+            'renderer': config.window.renderer,
+            'use_entity_store': config.game.use_entity_store,
+        },
+        'scenarios': {name: run_scenario(SCENARIOS[name], args.frames, args.warmup) for name in args.scenarios},
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,49 @@
+"""Measures how long `python main.py` takes to reach the Welcome screen: interpreter
+start, imports, asset loading, Game creation, setup and the first drawn frame.
+
+Run from the Space_Invaders directory:
+    python -m benchmarks.startup [runs]
+"""
+import os
+import sys
+import subprocess
+from statistics import median
+from timeit import default_timer as time
+
+
+# Does what main.py's __main__ block does, but stops after the first Welcome frame.
+STARTUP_SCRIPT = '''
+import main
+from util_objects import Screen
+from asset_registry import registry
+game = main.Game()
+game.clock = main.Clock()
+game.setup()
+assert game.current_screen == Screen.Welcome
+game.loop()
+print(registry.loads, len(registry.assets))
+'''
+
+
+def run_once():
+    start = time()
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT],
+                            capture_output=True, text=True, env=os.environ, check=True)
+    elapsed = time() - start
+    loads, declared = result.stdout.split()[-2:]
+    return elapsed, int(loads), int(declared)
+
+
+def main(runs=5):
+    times = []
+    for _ in range(runs):
+        elapsed, loads, declared = run_once()
+        times.append(elapsed)
+
+    print(f'startup to Welcome: median {median(times) * 1000:.1f} ms, '
+          f'min {min(times) * 1000:.1f} ms over {runs} runs')
+    print(f'assets loaded: {loads} of {declared} declared')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
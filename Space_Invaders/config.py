@@ -1,38 +1,79 @@
 import pygame
 from util_objects import *
+from asset_registry import ImageAsset, ImageListAsset, SoundAsset
+
+
+levels = (Screen.Level1, Screen.Level2, Screen.Level3)
 
 
 class window:
     size = (1024, 720)
     title = 'Space Invaders'
     fps_limit = 50
-    fps_history = 10
+    # Simulation ticks per second, the speeds in this file are per tick.
+    tick_rate = 50
+    # Most ticks simulated before drawing a frame when the game falls behind.
+    max_catch_up_ticks = 5
+    # Draw moving objects between their last two tick positions.
+    interpolate = False
+    fps_history = 60
+    # Clock.tick sleeps until this many seconds before a frame is due, then spin-waits.
+    spin_wait = 0.002
+    # 'full' redraws the whole screen every frame, 'dirty' only repaints what changed.
+    renderer = 'full'
 
     font = 'resources/FreeSans.ttf'
     text_antialias = False
     score_colour = (0, 255, 0)
+    # Most rendered strings kept by basic_objects.text_cache.
+    text_cache_size = 64
+    # Compose digit-only strings like the score from pre-rendered glyphs.
+    use_glyph_atlas = True
 
 
 class game:
     player_size = Coord(40, 40)
     player_reload = [800, 600, 300]
-    player_image1 = pygame.image.load('resources/spaceship1.png')
-    player_image2 = pygame.image.load('resources/spaceship2.png')
-    player_image3 = pygame.image.load('resources/spaceship3.png')
+    player_image1 = ImageAsset('resources/spaceship1.png', levels)
+    player_image2 = ImageAsset('resources/spaceship2.png', (Screen.Level2,))
+    player_image3 = ImageAsset('resources/spaceship3.png', (Screen.Level3,))
 
     enemy_down_shift = 10
 
     grid_size = Coord(100, 70)
-
-    bullet_img = pygame.image.load('resources/bullet1.png')
-    bullet_enemy_img = [
-        pygame.image.load('resources/bulletenemy.png'),
-        pygame.image.load('resources/bulletenemy2.png'),
-        pygame.image.load('resources/bulletenemy3.png')
-        ]
+    # Broadphase cell edge in pixels, roughly the size of the largest sprite.
+    collision_cell_size = 64
+    # Move, collide and cull bullets with vectorized NumPy passes (needs numpy installed).
+    use_entity_store = False
+    entity_store_capacity = 256
+
+    bullet_img = ImageAsset('resources/bullet1.png', levels)
+    bullet_enemy_img = ImageListAsset([
+        'resources/bulletenemy.png',
+        'resources/bulletenemy2.png',
+        'resources/bulletenemy3.png'
+        ], levels)
     bullet_speed = -10
+    # Bullets made up front for each type of shooter, see game_objects.BulletPool.
+    bullet_pool_sizes = {'Player': 8, 'Frigate': 32, 'Carrier': 32, 'Buff': 32}
+    bullet_pool_default_size = 16
 
     default_rect_colour = (255, 255, 255)
+    # Most scaled sprite surfaces kept by basic_objects.sprite_cache.
+    sprite_cache_size = 128
+    # Which collision layers test each other, both ways round. Bullets are on their shooter's side.
+    collision_matrix = {
+        CollisionLayer.Player: CollisionLayer.Enemies | CollisionLayer.EnemyBullets | CollisionLayer.Other,
+        CollisionLayer.PlayerBullets: CollisionLayer.Enemies | CollisionLayer.Other,
+        CollisionLayer.Enemies: CollisionLayer.Player | CollisionLayer.PlayerBullets | CollisionLayer.Other,
+        CollisionLayer.EnemyBullets: CollisionLayer.Player | CollisionLayer.Other,
+        CollisionLayer.Other: CollisionLayer.Player | CollisionLayer.PlayerBullets | CollisionLayer.Enemies
+                              | CollisionLayer.EnemyBullets | CollisionLayer.Other,
+    }
+    # Once their rects overlap, only collide objects whose opaque pixels overlap too.
+    pixel_perfect_collisions = True
+    # Most collision masks kept by basic_objects.mask_cache.
+    mask_cache_size = 128
 
     class level1:
         num_enemies = (5, 4)
@@ -48,30 +89,82 @@ class game:
 
 class enemy:
     class frigate:
-        img = pygame.image.load('resources/enemies/enemy_frigate.png')
-        speed = Velocity(x_y=(4, 0))
+        img = ImageAsset('resources/enemies/enemy_frigate.png', (Screen.Level1, Screen.Level2))
+        speed = CartesianVelocity(x_y=(4, 0))
         size = Coord(40, 40)
         points = 50
         fire_chance = 0.0005
         bullet_speed = 5
 
     class one:
-        img = pygame.image.load('resources/enemies/enemy1.png')
-        speed = Velocity(x_y=(6, 0.35))
+        img = ImageAsset('resources/enemies/enemy1.png', (Screen.Level2, Screen.Level3))
+        speed = CartesianVelocity(x_y=(6, 0.35))
         size = Coord(40, 40)
         points = 75
         fire_chance = 0.003
         bullet_speed = 6
 
     class spaceship:
-        img = pygame.image.load('resources/enemies/enemy2.png')
-        speed = Velocity(x_y=(2, 0.25))
+        img = ImageAsset('resources/enemies/enemy2.png', (Screen.Level3,))
+        speed = CartesianVelocity(x_y=(2, 0.25))
         size = Coord(40, 40)
         points = 120
         fire_chance = 0.00075
         bullet_speed = 7
 
 
+class atlas:
+    # Pack the gameplay sprites into one surface at the size they're drawn at, see atlas.py.
+    enabled = True
+    sprites = {
+        'enemy.frigate.img': enemy.frigate.size,
+        'enemy.one.img': enemy.one.size,
+        'enemy.spaceship.img': enemy.spaceship.size,
+        'game.player_image1': game.player_size,
+        'game.player_image2': game.player_size,
+        'game.player_image3': game.player_size,
+        'game.bullet_img': game.player_size,
+        'game.bullet_enemy_img': game.player_size,
+    }
+    max_width = 512
+    padding = 1
+    # The packed atlas is saved here and reused until a sprite or size changes.
+    cache_dir = '.cache'
+
+
+class profiler:
+    # Time every frame from the start. F3 shows the overlay, which also turns it on.
+    enabled = False
+    overlay_key = pygame.K_F3
+    # F4 captures the next `capture_frames` frames to `trace_path`.
+    trace_key = pygame.K_F4
+    capture_frames = 300
+    trace_path = 'profile_trace.json'
+    # 'chrome' for chrome://tracing or Perfetto, 'timeline' for per-frame phase times.
+    trace_format = 'chrome'
+    # Frames shown by the overlay's graph.
+    history = 120
+    graph_size = (240, 100)
+    font_size = 14
+    background = (0, 0, 0, 160)
+    budget_colour = (255, 255, 255)
+    colours = {
+        'handle_events': (255, 200, 0),
+        'simulate': (0, 160, 255),
+        'movement': (90, 200, 255),
+        'bounce': (140, 220, 255),
+        'collision': (190, 235, 255),
+        'draw': (255, 80, 80),
+        'sleep': (140, 140, 140),
+    }
+
+
+class replay:
+    # Record every game started with Game.run to `path`, replay it with `python replay.py <path>`.
+    record = False
+    path = 'recording.json'
+
+
 class logging:
     name_justify_length = 10
     terminal_log_level = 'DEBUG'
@@ -80,34 +173,52 @@ class logging:
         'main': 'ERROR',
         'basic_objects': 'INFO',
         'game_objects': 'INFO',
-        'game_objects.enemies': 'INFO'
+        'game_objects.enemies': 'INFO',
+        'entity_store': 'INFO',
+        'renderer': 'INFO',
+        'profiler': 'INFO',
+        'replay': 'INFO',
+        'atlas': 'INFO'
     }
+    # Loggers whose per-frame messages start enabled, see meta.set_hot_logging.
+    hot_path_loggers = set()
 
 
 class assets:
-    overlay = pygame.image.load('resources/assets/overlay.png')
+    # Images are loaded the first time they are used, see asset_registry.
+    menus = (Screen.Welcome, Screen.GameOver)
+    overlay = ImageAsset('resources/assets/overlay.png', menus)
     # buttons
-    bBlueGrn = pygame.image.load('resources/assets/2920872/bBlueGrn.png')
-    bPurple = pygame.image.load('resources/assets/2920872/bPurple.png')
-    bViolet = pygame.image.load('resources/assets/2920872/bViolet.png')
+    bBlueGrn = ImageAsset('resources/assets/2920872/bBlueGrn.png', menus)
+    bPurple = ImageAsset('resources/assets/2920872/bPurple.png', menus)
+    bViolet = ImageAsset('resources/assets/2920872/bViolet.png', menus)
     # welcome banner
-    bnrWelcome = pygame.image.load('resources/assets/bnrWelcome.png')
+    bnrWelcome = ImageAsset('resources/assets/bnrWelcome.png', (Screen.Welcome,))
     # gameover banner
-    bnrGmOver = pygame.image.load('resources/assets/bnrGameOver.png')
+    bnrGmOver = ImageAsset('resources/assets/bnrGameOver.png', (Screen.GameOver,))
+
+    # The screen whose assets are decoded in the background while each screen is shown.
+    preload_next = {
+        Screen.Welcome: Screen.Level1,
+        Screen.Level1: Screen.Level2,
+        Screen.Level2: Screen.Level3,
+        Screen.Level3: Screen.GameOver,
+        Screen.GameOver: Screen.Level1
+    }
 
     class background:
-        main = pygame.image.load("./resources/backgrounds/mainbackground.png")
-        level1 = pygame.image.load("./resources/backgrounds/background1.png")
-        level2 = pygame.image.load("./resources/backgrounds/background2.png")
-        level3 = pygame.image.load("./resources/backgrounds/background3.png")
+        main = ImageAsset("./resources/backgrounds/mainbackground.png", (Screen.Welcome, Screen.GameOver))
+        level1 = ImageAsset("./resources/backgrounds/background1.png", (Screen.Level1,))
+        level2 = ImageAsset("./resources/backgrounds/background2.png", (Screen.Level2,))
+        level3 = ImageAsset("./resources/backgrounds/background3.png", (Screen.Level3,))
 
 class music:
+    # pygame.init() happens when the Game is created, sounds load on first use.
     pygame.mixer.pre_init(44100, -16, 2, 512)
-    pygame.init()
 
-    bullet1 = pygame.mixer.Sound("./resources/sounds/Level1.mp3")
-    bullet2 = pygame.mixer.Sound("./resources/sounds/Level2.mp3")
-    bullet3 = pygame.mixer.Sound("./resources/sounds/Level3.mp3")
+    bullet1 = SoundAsset("./resources/sounds/Level1.mp3", (Screen.Level1,))
+    bullet2 = SoundAsset("./resources/sounds/Level2.mp3", (Screen.Level2,))
+    bullet3 = SoundAsset("./resources/sounds/Level3.mp3", (Screen.Level3,))
 
     def loadMusic(self, level):
         match level:
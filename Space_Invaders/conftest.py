@@ -0,0 +1,22 @@
+import os
+import pytest
+
+
+# Art and music a Game can't be set up without, but that isn't checked in.
+GAME_RESOURCES = (
+    'resources/backgrounds/mainbackground.png',
+    'resources/background_tracks/main.wav',
+)
+
+
+@pytest.fixture
+def game():
+    """A set up headless game. Skips the test where the game's resources are missing."""
+    missing = [path for path in GAME_RESOURCES if not os.path.exists(path)]
+    if missing:
+        pytest.skip(f'Missing game resources: {", ".join(missing)}')
+
+    import main
+    game = main.Game(headless=True, seed=0)
+    game.setup()
+    return game
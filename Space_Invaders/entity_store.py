@@ -0,0 +1,244 @@
+import config
+from util_objects import *
+from meta import create_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+log = create_logger('entity_store')
+
+
+def screen_bits(valid_screens):
+    """Bitmask of the screens an object is valid on, one bit per Screen value."""
+    if valid_screens is None:
+        return sum(1 << screen.value for screen in Screen)
+    if isinstance(valid_screens, Screen):
+        return 1 << valid_screens.value
+    return sum(1 << screen.value for screen in valid_screens)
+
+
+class EntityVelocity:
+    """Velocity handle for an entity in an EntityStore, reading and writing its row
+    of the store's velocity array."""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+
+    @property
+    def x(self):
+        return float(self.store.velocity[self.index, 0])
+
+    @x.setter
+    def x(self, new_x):
+        self.store.velocity[self.index, 0] = new_x
+
+
+    @property
+    def y(self):
+        return float(self.store.velocity[self.index, 1])
+
+    @y.setter
+    def y(self, new_y):
+        self.store.velocity[self.index, 1] = new_y
+
+
+    def components(self):
+        return (self.x, self.y)
+
+
+    def flip_x(self):
+        self.x = -self.x
+
+
+    def flip_y(self):
+        self.y = -self.y
+
+
+    def __repr__(self):
+        return f'EntityVelocity({self.x}, {self.y})'
+
+
+class EntityStore:
+    """Structure-of-arrays storage for bullets.
+
+    Positions, sizes, velocities, screen masks and collision layers live in
+    contiguous NumPy arrays. Stored bullets are left out of the per-object simulate
+    loop and the collision grid: movement, the collision broadphase and off-screen
+    culling each run as one vectorized pass per frame, and only the bullets whose
+    move passed over something they collide with get the exact swept test. The
+    Bullet objects stay around as handles for gameplay code and drawing, their rects
+    are written back after every move.
+
+    Enemies are not stored, EnemyFormation moves them.
+    """
+
+    def __init__(self, capacity=256, collision_matrix=None):
+        if collision_matrix is None:
+            collision_matrix = config.game.collision_matrix
+        self.layers = {layer: i for i, layer in enumerate(CollisionLayer)}
+        # layer_hits[a, b] is whether layer index a collides with layer index b.
+        self.layer_hits = np.array([[other in collision_matrix.get(layer, CollisionLayer(0)) for other in self.layers]
+                                    for layer in self.layers])
+
+        self.capacity = 0
+        self.count = 0  # high water mark of used slots
+        self.free = []
+        self.objects = []
+
+        self.position = np.zeros((0, 2))
+        self.size = np.zeros((0, 2))
+        self.velocity = np.zeros((0, 2))
+        self.screens = np.zeros(0, dtype=np.int64)
+        self.layer = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+
+        # The entities moved by the latest simulate() and where they moved from.
+        self.moved = np.zeros(0, dtype=np.int64)
+        self.moved_from = np.zeros((0, 2))
+
+        self.__grow__(capacity)
+
+
+    @staticmethod
+    def create():
+        """Returns a new store, or None if NumPy is not installed."""
+        if np is None:
+            log.warning('NumPy is not installed, simulating bullets one at a time.')
+            return None
+        return EntityStore(config.game.entity_store_capacity)
+
+
+    def __len__(self):
+        return self.count - len(self.free)
+
+
+    def __grow__(self, capacity):
+        extra = capacity - self.capacity
+        if extra <= 0: return
+
+        self.position = np.concatenate((self.position, np.zeros((extra, 2))))
+        self.size = np.concatenate((self.size, np.zeros((extra, 2))))
+        self.velocity = np.concatenate((self.velocity, np.zeros((extra, 2))))
+        self.screens = np.concatenate((self.screens, np.zeros(extra, dtype=np.int64)))
+        self.layer = np.concatenate((self.layer, np.zeros(extra, dtype=np.int64)))
+        self.alive = np.concatenate((self.alive, np.zeros(extra, dtype=bool)))
+        self.objects.extend([None] * extra)
+        self.capacity = capacity
+
+
+    def add(self, obj):
+        """Moves obj's movement state into the store and gives it an EntityVelocity handle."""
+        if self.free:
+            index = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.__grow__(self.capacity * 2)
+            index = self.count
+            self.count += 1
+
+        self.objects[index] = obj
+        self.position[index] = (obj.x, obj.y)
+        self.size[index] = (obj.width, obj.height)
+        self.velocity[index] = obj.velocity.components()
+        self.screens[index] = screen_bits(obj.valid_screens) if obj.simulating else 0
+        self.layer[index] = self.layers[obj.collision_layer]
+        self.alive[index] = True
+
+        obj.entity = index
+        obj.mover = self
+        obj.velocity = EntityVelocity(self, index)
+        return index
+
+
+    def remove(self, obj):
+        index = obj.entity
+        if index is None or self.objects[index] is not obj: return False
+
+        self.alive[index] = False
+        self.objects[index] = None
+        self.free.append(index)
+        obj.velocity = CartesianVelocity(*self.velocity[index].tolist())
+        obj.entity = None
+        obj.mover = None
+        return True
+
+
+    def simulate(self, game):
+        """Moves every live entity on the current screen and writes their rects back."""
+        self.moved = np.zeros(0, dtype=np.int64)
+        n = self.count
+        if n == len(self.free): return
+
+        profiler = game.profiler
+        if profiler.enabled: start = time()
+
+        active = self.alive[:n] & ((self.screens[:n] & (1 << game.current_screen.value)) != 0)
+        indices = np.flatnonzero(active)
+        if len(indices) == 0: return
+
+        position = self.position
+        self.moved = indices
+        self.moved_from = position[indices]
+
+        # Movement, rounded the way pygame rounds a float assigned to a Rect.
+        moved = self.moved_from + self.velocity[indices]
+        moved = np.trunc(moved + np.copysign(0.5, moved))
+        position[indices] = moved
+
+        objects = self.objects
+        for index, (x, y) in zip(indices.tolist(), moved.tolist()):
+            obj = objects[index]
+            obj.last_x = obj.x
+            obj.last_y = obj.y
+            obj.x = x
+            obj.y = y
+        if profiler.enabled:
+            profiler.add('movement', time() - start)
+
+
+    def collide(self, targets):
+        """The entities moved by the latest simulate() whose path passed over one of
+        `targets` on a layer they collide with, in slot order.
+
+        This is only a broadphase on the bounding boxes of each whole move, the
+        candidates still need Simulatable.__detect_collisions_with_objects__. Boxing
+        the targets takes a Python pass over them, so with fewer bullets than targets
+        every bullet is a candidate and looks in the collision grid itself.
+        """
+        if len(self.moved) == 0 or not targets: return []
+        indices = self.moved[self.alive[self.moved]]
+        objects = self.objects
+        if len(indices) < len(targets):
+            return [objects[index] for index in indices.tolist()]
+
+        layers = self.layers
+        boxes = np.array([(obj.x, obj.y, obj.right, obj.bottom, layers[obj.collision_layer]) for obj in targets])
+
+        start = self.moved_from[self.alive[self.moved]]
+        end = self.position[indices]
+        low = np.minimum(start, end)
+        high = np.maximum(start, end) + self.size[indices]
+
+        near = self.layer_hits[self.layer[indices]][:, boxes[:, 4].astype(np.int64)]
+        near &= low[:, 0, None] < boxes[None, :, 2]
+        near &= high[:, 0, None] > boxes[None, :, 0]
+        near &= low[:, 1, None] < boxes[None, :, 3]
+        near &= high[:, 1, None] > boxes[None, :, 1]
+        return [objects[index] for index in indices[near.any(axis=1)].tolist()]
+
+
+    def culled(self):
+        """The entities moved by the latest simulate() that are still alive and off the
+        top or bottom of the screen, and should be deleted."""
+        if len(self.moved) == 0: return []
+        indices = self.moved[self.alive[self.moved]]
+        ys = self.position[indices, 1]
+        off_screen = indices[(ys <= 0) | (ys >= config.window.size[1] - 1)]
+        objects = self.objects
+        return [objects[index] for index in off_screen.tolist()]
@@ -1,16 +1,18 @@
 import pygame
 import config
 import copy
-import random
+import heapq
 import traceback
 from basic_objects import *
+from asset_registry import registry as asset_registry
 from util_objects import *
 from math import copysign
-from meta import create_logger
+from meta import create_logger, create_hot_logger
 from random import randint
 
 
 log = create_logger('game_objects')
+hot_log = create_hot_logger('game_objects', log)
 
 
 class GameOverScreen(Drawable):
@@ -49,17 +51,17 @@ class GameOverScreen(Drawable):
         )
 
 
+    def render_state(self):
+        # Buttons change with the mouse, so menus are always redrawn in full.
+        return None
+
+
     def __draw__(self, screen):
         if not self.visible: return
-        if self.valid_screens is not None:
-            if isinstance(self.valid_screens, Screen):
-                if self.game.current_screen != self.valid_screens: return False
-            elif isinstance(self.valid_screens, tuple):
-                if self.game.current_screen not in self.valid_screens: return False
 
         self.gmOver.draw(screen, False)
         if self.btnPlayAgn.draw(screen, True):
-            self.game.change_screen(Screen.Level1)
+            self.game.request_screen(Screen.Level1)
         if self.btnExit.draw(screen, True):
             self.game.exit()
 
@@ -107,18 +109,18 @@ class WelcomeScreen(Drawable):
         if 'img' in kwargs: del kwargs['img']
 
 
+    def render_state(self):
+        # Buttons change with the mouse, so menus are always redrawn in full.
+        return None
+
+
     def __draw__(self, screen):
         if not self.visible: return
-        if self.valid_screens is not None:
-            if isinstance(self.valid_screens, Screen):
-                if self.game.current_screen != self.valid_screens: return False
-            elif isinstance(self.valid_screens, tuple):
-                if self.game.current_screen not in self.valid_screens: return False
 
         self.bnrWelcome.draw(screen, False)
         if self.btnPlay.draw(screen, True):
             self.game.play_status = True
-            self.game.change_screen(Screen.Level1)
+            self.game.request_screen(Screen.Level1)
         if self.btnExit.draw(screen, True):
             self.game.exit()
 
@@ -126,49 +128,92 @@ class WelcomeScreen(Drawable):
 class Text(Drawable):
     """Some text that will be drawn on the screen."""
 
+    layer = Layer.HUD
+
     def __init__(self, font=None, *, colour, value, **kwargs):
         self.value = value
         self.colour = colour
         self.font = font
+        self.surface = None  # rendered on the first draw after each update
 
         # initialize the Drawable object that this inherits from, also pass any unexpected key=value arguments to the Drawable object.
         super().__init__(**kwargs)
 
     def update(self, newString):
         self.value = newString
+        self.surface = None
 
     def get_content(self):
         return self.value
 
+    def render(self):
+        font = self.game.default_font if self.font is None else self.font
+        string = f"{self.value}"
+        if config.window.use_glyph_atlas:
+            atlas = glyph_atlas(font, config.window.text_antialias, self.colour)
+            if atlas.can_render(string):
+                return atlas.render(string)
+        return text_cache.render(font, string, config.window.text_antialias, self.colour)
+
+    def render_state(self):
+        if self.surface is None:
+            self.surface = self.render()
+        return ((self.x, self.y, *self.surface.get_size()), self.surface)
+
+    def blit_item(self):
+        if self.surface is None:
+            self.surface = self.render()
+        return (self.surface, (self.x, self.y))
+
     def __draw__(self, screen):
-        if self.font is None:
-            surface = self.game.default_font.render(
-                f"{self.value}", config.window.text_antialias, self.colour
-            )
-        else:
-            surface = self.font.render(
-                f"{self.value}", config.window.text_antialias, self.colour
-            )
+        if self.surface is None:
+            self.surface = self.render()
 
-        screen.blit(surface, (self.x, self.y))
+        screen.blit(self.surface, (self.x, self.y))
 
 
 class Background(Drawable):
-    """A background image that will be drawn on the screen."""
+    """A background image that will be drawn on the screen.
 
-    def __init__(self, **kwargs):
+    Pass `asset='assets.background.level1'` instead of `img` to load the image the
+    first time the background is drawn.
+    """
+
+    layer = Layer.Background
+
+    def __init__(self, asset=None, **kwargs):
         if "position" not in kwargs:
             kwargs["position"] = Coord(0, 0)
         if "size" not in kwargs:
             kwargs["size"] = Coord(config.window.size[0], config.window.size[1])
 
+        self.asset = asset_registry.get(asset) if asset is not None else None
+
         # initialize the Drawable object that this inherits from, also pass any unexpected key=value arguments to the Drawable object.
         super().__init__(**kwargs)
 
 
+    def __load__(self):
+        if self.img is None and self.asset is not None:
+            self.img = sprite_cache.scale(self.asset.load(), self.size)
+
+
+    def blit_item(self):
+        self.__load__()
+        return super().blit_item()
+
+
+    def __draw__(self, screen):
+        self.__load__()
+        return super().__draw__(screen)
+
+
 class Player(Simulatable):
     """The player ship."""
 
+    layer = Layer.Player
+    collision_layer = CollisionLayer.Player
+
     def __init__(self, **kwargs):
         if "img" not in kwargs:
             kwargs["img"] = pygame.image.load("resources/spaceship.png")
@@ -205,15 +250,15 @@ class Player(Simulatable):
 
     def fire_bullet(self):
         if self.loaded:
-            Bullet(
-                position=self.position,
-                game=self.game,
-                velocity=Velocity(x_y=(0, config.game.bullet_speed)),
-                source=self
+            bullet_pool(self.game, self).acquire(
+                source=self,
+                position=(self.x, self.y),
+                velocity=(0, config.game.bullet_speed),
+                img=config.game.bullet_img
             )
             pygame.mixer.Sound.play(self.sound)
             self.loaded = False
-            pygame.time.set_timer(self.game.RELOAD, self.reload_timer)
+            self.game.set_timer(self.game.RELOAD, self.reload_timer)
 
 
     def changeImage(self, level):
@@ -226,6 +271,10 @@ class Player(Simulatable):
 
 
 class Bullet(Simulatable):
+    bulk_simulated = True
+    layer = Layer.Bullets
+    swept = True
+
     def __init__(self, *, source, **kwargs):
         if "img" not in kwargs:
             kwargs["img"] = config.game.bullet_img
@@ -243,21 +292,58 @@ class Bullet(Simulatable):
             kwargs["collide"] = False
 
         self.source = source
+        self.collision_layer = self.team_layer(source)
+        self.source_img = kwargs["img"]  # unscaled, self.img is the sprite drawn
+        self.pool = None  # the BulletPool this goes back to when deleted
+        self.pooled = False  # waiting in its pool's free list
 
         super().__init__(**kwargs)
 
-        self.game.bullets.append(self)
+        self.game.bullets.add(self)
+
+
+    def reset(self, *, source, position, velocity, img):
+        """Reuses a detached bullet for a new shot."""
+        self.source = source
+        self.collision_layer = self.team_layer(source)
+        if isinstance(position, Coord):
+            position = position.as_tuple
+        self.x = self.last_x = position[0]
+        self.y = self.last_y = position[1]
+        self.velocity.x, self.velocity.y = velocity
+        if self.source_img is not img:
+            self.source_img = img
+            self.img = sprite_cache.scale(img, self.size)
+
+
+    @staticmethod
+    def team_layer(source):
+        """Bullets only hit the other side, whoever fired them."""
+        if isinstance(source, Player):
+            return CollisionLayer.PlayerBullets
+        return CollisionLayer.EnemyBullets
+
+
+    def attach(self):
+        super().attach()
+        self.game.bullets.add(self)
+
+
+    def detach(self):
+        self.game.bullets.remove(self)
+        super().detach()
 
 
     def delete(self):
-        if self in self.game.bullets:
-            self.game.bullets.remove(self)
-        super().delete()
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.detach()
 
 
     def __isimulate__(self):
-        if isinstance(self.source, Player):
-            log.debug(f'Bullet position: {self.x, self.y}')
+        if hot_log.enabled and isinstance(self.source, Player):
+            hot_log.debug(f'Bullet position: {self.x, self.y}')
         if super().__isimulate__():
             if self.position.y <= 0:
                 self.delete()
@@ -277,15 +363,27 @@ class Bullet(Simulatable):
 class Enemy(Simulatable):
     """A single enemy ship."""
 
-    def __init__(self, points, *, bullet_speed, fire_chance, **kwargs):
+    layer = Layer.Enemies
+    collision_layer = CollisionLayer.Enemies
+
+    def __init__(self, points, *, bullet_speed, fire_chance, formation=None, **kwargs):
 
         self.points = points
         self.bullet_speed = bullet_speed
         self.fire_chance = fire_chance
+        self.formation = formation
+        self.mover = formation
+        if kwargs.get('velocity') is not None:
+            kwargs['velocity'] = kwargs['game'].shared_velocity(kwargs['velocity'])
 
         super().__init__(**kwargs)
 
-        self.game.enemies.append(self)
+        self.game.enemies.add(self)
+        self.game.screen_enemies.add(self)
+        self.next_fire = None  # tick the FireScheduler fires this on
+        self.game.fire_scheduler.add(self)
+        if formation is not None:
+            formation.add(self)
 
 
     def __eq__(self, other):
@@ -301,8 +399,11 @@ class Enemy(Simulatable):
 
     def delete(self):
         """Delete all references to this enemy so they are removed from memory."""
-        if self in self.game.enemies:
-            self.game.enemies.remove(self)
+        self.game.enemies.remove(self)
+        self.game.screen_enemies.remove(self)
+        self.next_fire = None
+        if self.formation is not None:
+            self.formation.remove(self)
         super().delete()
 
 
@@ -315,13 +416,12 @@ class Enemy(Simulatable):
 
 
     def screen_edge_callback(self, side):
+        """Only called for enemies outside of a formation, formations bounce as a whole."""
         super().screen_edge_callback(side)
 
         if self.game.enemies_last_bounce_side != side:
             log.debug(f'Hit new screen edge {self.game.enemies_last_bounce_side} to {side}')
-            for enemy in self.game.visible_enemies():
-                enemy.position.y += config.game.enemy_down_shift
-                enemy.y += config.game.enemy_down_shift
+            self.game.shift_enemies_down(config.game.enemy_down_shift)
             self.game.enemies_last_bounce_side = side
 
 
@@ -329,8 +429,6 @@ class Enemy(Simulatable):
         if super().__isimulate__():
             if self.y >= 700:
                 self.game.change_screen(Screen.GameOver)
-            if random.random() < self.fire_chance:
-                self.fire_bullet()
 
 
     def fire_bullet(self):
@@ -339,15 +437,252 @@ class Enemy(Simulatable):
             bullet_img = config.game.bullet_enemy_img[1]
         elif self.points == 50:
             bullet_img = config.game.bullet_enemy_img[0]
-        Bullet(
-            position=self.position,
-            game=self.game,
-            velocity=Velocity(x_y=(0, self.bullet_speed)),
+        bullet_pool(self.game, self).acquire(
             source=self,
+            position=(self.x, self.y),
+            velocity=(0, self.bullet_speed),
             img=bullet_img
         )
 
 
+class EnemyFormation:
+    """A block of enemies made by Game.generate_enemies that moves as one.
+
+    The formation keeps the bounding box of its live enemies, so moving sideways,
+    reversing at a screen edge and stepping down are worked out once per tick for
+    the whole block rather than by every enemy. Its enemies share one velocity, the
+    game's copy of their class's config speed, and skip Simulatable's own movement.
+    """
+
+    def __init__(self, game, screen):
+        self.game = game
+        self.screen = screen
+        self.members = Registry()
+        self.velocity = None
+        self.left = self.top = self.right = self.bottom = None
+        self.bounds_stale = False  # a member was removed or moved on its own
+        self.dx = 0
+        self.dy = 0
+
+
+    def __len__(self):
+        return len(self.members)
+
+
+    def add(self, enemy):
+        if self.velocity is None:
+            self.velocity = enemy.velocity
+        self.members.add(enemy)
+        if self.left is None:
+            self.left, self.top, self.right, self.bottom = enemy.left, enemy.top, enemy.right, enemy.bottom
+        else:
+            self.left = min(self.left, enemy.left)
+            self.top = min(self.top, enemy.top)
+            self.right = max(self.right, enemy.right)
+            self.bottom = max(self.bottom, enemy.bottom)
+
+
+    def remove(self, enemy):
+        if self.members.remove(enemy):
+            self.bounds_stale = True
+
+
+    def __update_bounds__(self):
+        self.left = self.top = self.right = self.bottom = None
+        self.bounds_stale = False
+        for enemy in self.members:
+            if self.left is None:
+                self.left, self.top, self.right, self.bottom = enemy.left, enemy.top, enemy.right, enemy.bottom
+            else:
+                self.left = min(self.left, enemy.left)
+                self.top = min(self.top, enemy.top)
+                self.right = max(self.right, enemy.right)
+                self.bottom = max(self.bottom, enemy.bottom)
+
+
+    @staticmethod
+    def __step_towards__(edge, speed):
+        """Pixels an edge moves by, rounded the way a Rect rounds a float position."""
+        moved = edge + speed
+        return int(moved + copysign(0.5, moved)) - edge
+
+
+    def step(self):
+        """Moves the bounding box by a tick of the formation's velocity and reverses the
+        velocity at a screen edge. Returns the side bounced off, or None.
+        The enemies themselves are moved by apply()."""
+        if self.bounds_stale:
+            self.__update_bounds__()
+        if self.left is None:
+            self.dx = self.dy = 0
+            return None
+
+        self.dx = self.__step_towards__(self.left, self.velocity.x)
+        self.dy = self.__step_towards__(self.top, self.velocity.y)
+        self.left += self.dx
+        self.right += self.dx
+
+        if self.left <= 0:
+            self.velocity.x = abs(self.velocity.x)
+            return 'left'
+        elif self.right >= config.window.size[0]:
+            self.velocity.x = -abs(self.velocity.x)
+            return 'right'
+        return None
+
+
+    def apply(self, down_shift=0):
+        """Moves every enemy by this tick's step, plus `down_shift` pixels down."""
+        if not self.members: return
+        dx = self.dx
+        dy = self.dy + down_shift
+        self.top += dy
+        self.bottom += dy
+        for enemy in self.members:
+            enemy.last_x = enemy.x
+            enemy.last_y = enemy.y
+            enemy.x += dx
+            enemy.y += dy
+
+
+    def shift(self, dy):
+        """Moves every enemy down `dy` pixels outside of the tick's step."""
+        if not self.members: return
+        self.top += dy
+        self.bottom += dy
+        for enemy in self.members:
+            enemy.y += dy
+
+
+class BulletPool:
+    """Recycles the bullets fired by one type of source.
+
+    `size` bullets are made up front, the first time one is fired, and deleted
+    bullets go back to the free list instead of being thrown away. When every
+    bullet is in flight a new one is made and kept, which counts as the pool
+    being exhausted; stats() shows how often that happens so the sizes in
+    config.game.bullet_pool_sizes can be tuned.
+    """
+
+    def __init__(self, game, size):
+        self.game = game
+        self.size = size
+        self.free = []
+        self.created = 0
+        self.acquired = 0
+        self.exhausted = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+
+    def __new_bullet__(self, **kwargs):
+        bullet = Bullet(game=self.game, **kwargs)
+        bullet.pool = self
+        self.created += 1
+        return bullet
+
+
+    def __fill__(self, source, img):
+        for i in range(self.size - self.created):
+            bullet = self.__new_bullet__(source=source, img=img)
+            bullet.detach()
+            bullet.pooled = True
+            self.free.append(bullet)
+
+
+    def acquire(self, *, source, position, velocity, img):
+        """A bullet fired by `source` from `position` with `velocity`, given as (x, y)
+        so a recycled bullet can keep its own velocity object."""
+        if self.created == 0:
+            self.__fill__(source, img)
+
+        if self.free:
+            bullet = self.free.pop()
+            bullet.pooled = False
+            bullet.reset(source=source, position=position, velocity=velocity, img=img)
+            bullet.attach()
+        else:
+            self.exhausted += 1
+            bullet = self.__new_bullet__(source=source, position=position, velocity=CartesianVelocity(*velocity), img=img)
+
+        self.acquired += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return bullet
+
+
+    def release(self, bullet):
+        # A bullet can be deleted twice in a tick, say hitting something as it leaves the screen.
+        if bullet.pooled: return
+        bullet.detach()
+        bullet.pooled = True
+        self.free.append(bullet)
+        self.in_use -= 1
+
+
+    def stats(self):
+        return {'size': self.created, 'free': len(self.free), 'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use, 'acquired': self.acquired, 'exhausted': self.exhausted}
+
+
+def bullet_pool(game, source):
+    """The game's BulletPool for bullets fired by `source`'s type."""
+    source_type = type(source).__name__
+    pool = game.bullet_pools.get(source_type)
+    if pool is None:
+        size = config.game.bullet_pool_sizes.get(source_type, config.game.bullet_pool_default_size)
+        pool = game.bullet_pools[source_type] = BulletPool(game, size)
+    return pool
+
+
+class FireScheduler:
+    """Decides which enemies fire on each tick.
+
+    An enemy fires with its fire_chance on every tick it's simulated, so the number
+    of ticks until its next shot is geometrically distributed. That is drawn once
+    when the enemy is added and again after every shot, and enemies wait in a heap
+    ordered by the tick they fire on. A tick then costs a look at the top of the
+    heap instead of a random roll for every enemy.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.heap = []  # (tick, order, enemy), order keeps enemies firing on the same tick in the order added
+        self.order = 0
+
+
+    def __len__(self):
+        return len(self.heap)
+
+
+    def add(self, enemy):
+        delay = trials_until_success(self.game.random, enemy.fire_chance)
+        if delay is None: return
+        enemy.next_fire = self.game.ticks + delay
+        heapq.heappush(self.heap, (enemy.next_fire, self.order, enemy))
+        self.order += 1
+
+
+    def due(self):
+        """Pops the enemies firing this tick and schedules their next shot.
+        Deleted enemies are dropped, and enemies that aren't being simulated this tick
+        are rescheduled without firing."""
+        tick = self.game.ticks
+        heap = self.heap
+        firing = []
+        while heap and heap[0][0] <= tick:
+            fire_tick, _, enemy = heapq.heappop(heap)
+            if enemy.next_fire != fire_tick: continue
+            if enemy.simulating and enemy in self.game.screen_enemies:
+                firing.append(enemy)
+            self.add(enemy)
+        return firing
+
+
+    def clear(self):
+        self.heap.clear()
+
+
 class renderImage:
     def __init__(self, btn_text, gui, x, y, btn, btnClicked, scale):
         self.btn_text = btn_text
@@ -368,7 +703,7 @@ class renderImage:
         )
         self.rect = self.image.get_rect(center=(self.x, self.y))
         self.rect.topleft = (x, y)
-        self.text = self.gui.render(self.btn_text, True, "white")
+        self.text = text_cache.render(self.gui, self.btn_text, True, "white")
         self.text_rect = self.text.get_rect(
             center=(
                 self.x + self.image.get_width() / 2,
@@ -1,48 +1,86 @@
+import os
 import config
 import pygame
 import copy
-from random import seed
+import hashlib
+from random import Random, randrange
 from timeit import default_timer as time
 from meta import *
 from util_objects import *
 from game_objects import *
 from enemies import *
+from entity_store import EntityStore
+from asset_registry import registry as asset_registry
+from renderer import create_renderer
+from profiler import FrameProfiler, ProfilerOverlay
+from replay import Recorder
+from atlas import SpriteAtlas
 
 
 log = create_logger("main")
+hot_log = create_hot_logger("main", log)
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, seed=None):
         """This is the creation of a Game object (the window and things required for the window).
-        Things that are required to start a game but not to run the window should go in setup()."""
+        Things that are required to start a game but not to run the window should go in setup().
+
+        A headless game uses SDL's dummy video and audio drivers, never draws, and is
+        advanced with step() as fast as the CPU allows.
+
+        Everything random in the game draws from `self.random`, seeded with `seed` (a
+        random one if not given), so the seed and the handled events are enough to
+        replay a game, see replay.py.
+        """
+        self.headless = headless
+        self.seed = seed if seed is not None else randrange(2 ** 32)
+        self.random = Random(self.seed)
+        self.recorder = None  # a replay.Recorder while the game is being recorded
+        self.fire_scheduler = FireScheduler(self)
+        self.bullet_pools = {}  # source type name -> BulletPool, see game_objects.bullet_pool
+        self.formations = []  # EnemyFormations made by generate_enemies
+        self.shared_velocities = {}  # id(config velocity) -> (config velocity, this game's copy)
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        pygame.init()
         self.screen = pygame.display.set_mode(config.window.size)
         self.current_screen = Screen.Welcome
         self.running = True
-        self.drawables = []
-        self.simulatables = []
+        self.drawables = Registry()
+        self.simulatables = Registry()
+        self.enemies = Registry()
+        self.bullets = Registry()
+        # The same objects bucketed by screen, so per-frame loops only walk the current screen's.
+        self.screen_drawables = LayeredScreenBuckets(self.current_screen)
+        self.screen_simulatables = ScreenBuckets(self.current_screen)
+        self.screen_enemies = ScreenBuckets(self.current_screen)
+        self.collision_grid = LayeredSpatialHash(config.game.collision_cell_size, config.game.collision_matrix)
+        self.entity_store = EntityStore.create() if config.game.use_entity_store else None
+        self.renderer = create_renderer(config.window.renderer)
+        self.profiler = FrameProfiler(config.profiler.history)
+        self.profiler.enabled = config.profiler.enabled
         self.default_font = None  # used by FontDrawable objects as the default font.
         self.enemies_last_bounce_side = None
         self.play_status = False  # Sets the playable status of the game
         self.game_over = False  #  is set to True when the player loses the game. This will allow the Game over screen to come up.
         self.donePlay = False
+        self.clock = Clock()
+        self.ticks = 0  # simulation ticks since the game was created
+        self.interpolation = None  # fraction of a tick to draw ahead, see run()
+        self.tick_timers = {}  # event type -> [interval, next tick], timers for headless games
 
         self.finishSound = pygame.mixer.Sound("resources/sounds/finish.wav")
 
-    def __collidable_object_filter__(self, obj):
-        if obj.valid_screens is not None:
-            if isinstance(obj.valid_screens, Screen):
-                if self.current_screen != obj.valid_screens: return False
-            elif isinstance(obj.valid_screens, tuple):
-                if self.current_screen not in obj.valid_screens: return False
-        return True
-
-
     def change_screen(self, new_screen):
         if not isinstance(new_screen, Screen):
             raise TypeError('Need to use the Screen objects above like `Screen.Welcome`.')
 
         self.current_screen = new_screen
+        self.screen_drawables.switch(new_screen)
+        self.screen_simulatables.switch(new_screen)
+        self.screen_enemies.switch(new_screen)
 
         match new_screen:
             case Screen.Welcome:
@@ -56,27 +94,89 @@ class Game:
             case Screen.Level3:
                 self.reload_screen_level3(self.current_screen)
 
+        self.rebuild_collision_grid()
+        asset_registry.preload(config.assets.preload_next[new_screen])
+
+
+    def shared_velocity(self, velocity):
+        """This game's own copy of a velocity many objects share, like an enemy class's
+        config speed. Bounces reverse the copy, so they don't carry over to the next game."""
+        entry = self.shared_velocities.get(id(velocity))
+        if entry is None or entry[0] is not velocity:
+            entry = self.shared_velocities[id(velocity)] = (velocity, CartesianVelocity.from_velocity(velocity))
+        return entry[1]
+
 
     def collidable_objects(self):
-        return filter(self.__collidable_object_filter__, self.simulatables)
+        return iter(self.screen_simulatables)
 
 
     def visible_enemies(self):
-        return list(filter(self.__collidable_object_filter__, self.enemies))
+        return list(self.screen_enemies)
 
 
     def exit(self):
-        self.running = False
+        """Quits once the event is handled, so recordings see it."""
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+
+    def request_screen(self, screen):
+        """Changes screen once the event is handled, for changes asked for outside of
+        handle_events and simulate like the menu buttons, so recordings see them."""
+        pygame.event.post(pygame.event.Event(self.CHANGE_SCREEN, screen=screen.value))
 
 
     def run(self):
-        """This is called to start running the game."""
+        """This is called to start running the game.
+
+        The simulation runs at a fixed config.window.tick_rate no matter how fast
+        frames are drawn. Time is accumulated every frame and spent in whole ticks, at
+        most config.window.max_catch_up_ticks per frame, so a slow host draws fewer
+        frames instead of slowing the game down.
+        """
         self.clock = Clock()
-        seed(time())
+        if config.replay.record:
+            self.recorder = Recorder(self, config.replay.path)
         self.setup()
+
+        tick_length = 1 / config.window.tick_rate
+        accumulator = 0.0
+        previous = self.clock.time()
         while self.running:
-            self.loop()
-            self.clock.tick(config.window.fps_limit)
+            now = self.clock.time()
+            accumulator += now - previous
+            previous = now
+
+            self.__timed__('handle_events', self.handle_events)
+            ticks = 0
+            while accumulator >= tick_length and ticks < config.window.max_catch_up_ticks:
+                self.__timed__('simulate', self.simulate)
+                accumulator -= tick_length
+                ticks += 1
+            if accumulator >= tick_length:
+                # Too far behind to catch up, drop the backlog rather than spiral.
+                if hot_log.enabled: hot_log.debug(f'Dropped {accumulator / tick_length:.1f} ticks')
+                accumulator = 0.0
+
+            if config.window.interpolate:
+                self.interpolation = accumulator / tick_length
+            self.__timed__('draw', self.draw)
+            self.__timed__('sleep', self.clock.tick, config.window.fps_limit)
+            if self.profiler.enabled:
+                self.profiler.end_frame()
+
+        if self.recorder is not None:
+            self.recorder.save()
+
+
+    def __timed__(self, phase, method, *args):
+        """Calls method, timing it as `phase` of the frame while the profiler is on."""
+        if not self.profiler.enabled:
+            return method(*args)
+        start = time()
+        result = method(*args)
+        self.profiler.span(phase, start, time())
+        return result
 
 
     def setup(self):
@@ -88,16 +188,19 @@ class Game:
         config.music.loadMusic(self, 1)
 
         pygame.display.set_caption(config.window.title)
+        if sprite_cache.atlas is None:
+            sprite_cache.atlas = SpriteAtlas.create()
+        prepare_assets(self.drawables)
 
         self.default_font = pygame.font.Font(config.window.font, 24)
 
         self.btn_font = pygame.font.Font(None, 30)
 
-        self.backgroundmain = Background(img=config.assets.background.main, game=self, valid_screens=Screen.Welcome)
-        self.background1 = Background(img=config.assets.background.level1, game=self, valid_screens=Screen.Level1)
-        self.background2 = Background(img=config.assets.background.level2, game=self, valid_screens=Screen.Level2)
-        self.background3 = Background(img=config.assets.background.level3, game=self, valid_screens=Screen.Level3)
-        self.backgroundgame = Background(img=config.assets.background.main, game=self, valid_screens=Screen.GameOver)
+        self.backgroundmain = Background(asset='assets.background.main', game=self, valid_screens=Screen.Welcome)
+        self.background1 = Background(asset='assets.background.level1', game=self, valid_screens=Screen.Level1)
+        self.background2 = Background(asset='assets.background.level2', game=self, valid_screens=Screen.Level2)
+        self.background3 = Background(asset='assets.background.level3', game=self, valid_screens=Screen.Level3)
+        self.backgroundgame = Background(asset='assets.background.main', game=self, valid_screens=Screen.GameOver)
 
         self.score = Text(
             colour=(config.window.score_colour),
@@ -114,45 +217,178 @@ class Game:
                              position = Coord(config.window.size[0] / 2 - config.game.player_size.x / 2, 600), sound=config.music.bullet1)
 
         self.RELOAD = pygame.event.custom_type()
+        self.CHANGE_SCREEN = pygame.event.custom_type()
+        # Recordings store these by name, their numbers depend on when they were made.
+        self.custom_events = {'CHECKLEVEL': self.CHECKLEVEL, 'RELOAD': self.RELOAD, 'CHANGE_SCREEN': self.CHANGE_SCREEN}
 
-        # Create some example enemies
-        self.enemies = []
-        self.bullets = []
 
-        self.welcomeScreen = WelcomeScreen(game=game, valid_screens=Screen.Welcome)
-        self.gameOverScreen = GameOverScreen(game=game, valid_screens=Screen.GameOver)
+        self.welcomeScreen = WelcomeScreen(game=self, valid_screens=Screen.Welcome)
+        self.gameOverScreen = GameOverScreen(game=self, valid_screens=Screen.GameOver)
+
+        # Created last so it's drawn over everything else.
+        self.profiler_overlay = ProfilerOverlay(game=self, font=pygame.font.Font(config.window.font, config.profiler.font_size))
 
         self.change_screen(Screen.Welcome)
 
 
     def loop(self):
         """Run every frame."""
-        self.handle_events()
-        self.simulate()
-        self.draw()
+        self.__timed__('handle_events', self.handle_events)
+        self.__timed__('simulate', self.simulate)
+        if not self.headless:
+            self.__timed__('draw', self.draw)
+        if self.profiler.enabled:
+            self.profiler.end_frame()
+
+
+    def step(self, n=1, inputs=None):
+        """Advances a game by `n` simulation ticks without drawing or waiting.
+
+        `inputs` is an optional sequence with one list of pygame events per tick, they
+        are handled the same way as events from the event queue. Timers set with
+        set_timer fire on tick counts instead of wall-clock time in headless games.
+        Stops early if the game exits. Returns the number of ticks simulated.
+        """
+        for i in range(n):
+            if not self.running:
+                return i
+            events = list(inputs[i]) if inputs is not None and i < len(inputs) else []
+            events.extend(self.__due_timer_events__())
+            self.__timed__('handle_events', self.handle_events, events)
+            self.__timed__('simulate', self.simulate)
+            if self.profiler.enabled:
+                self.profiler.end_frame()
+        return n
+
+
+    def set_timer(self, event_type, millis):
+        """Like pygame.time.set_timer, but counted in simulation ticks for headless games.
+        A `millis` of 0 stops the timer."""
+        if not self.headless:
+            pygame.time.set_timer(event_type, millis)
+        elif millis == 0:
+            self.tick_timers.pop(event_type, None)
+        else:
+            interval = max(1, round(millis * config.window.tick_rate / 1000))
+            self.tick_timers[event_type] = [interval, self.ticks + interval]
+
+
+    def __due_timer_events__(self):
+        due = []
+        for event_type, timer in self.tick_timers.items():
+            if self.ticks >= timer[1]:
+                timer[1] += timer[0]
+                due.append(pygame.event.Event(event_type))
+        return due
 
 
     def simulate(self):
         """Performs moving of objects, collisions, any simulation tasks."""
-        for simulatable in self.simulatables:
+        self.ticks += 1
+        if self.entity_store is not None:
+            self.entity_store.simulate(self)
+
+        if self.formations:
+            self.move_formations()
+
+        if self.profiler.enabled:
+            start = time()
+            self.rebuild_collision_grid()
+            self.profiler.add('collision', time() - start)
+        else:
+            self.rebuild_collision_grid()
+        for simulatable in self.screen_simulatables:
             simulatable.__isimulate__()
+        if self.entity_store is not None:
+            self.collide_stored_bullets()
+
+        # Every enemy firing this tick fires together, from where it ended up.
+        for enemy in self.fire_scheduler.due():
+            enemy.fire_bullet()
+
+
+    def move_formations(self):
+        """Moves the enemy formations on this screen. The first to reach a new side of
+        the screen moves every enemy down, like a lone enemy bouncing does. Formations
+        whose enemies are all dead are dropped.
+
+        Stepping the bounding boxes, which is where they reverse, and the down-shift
+        of enemies outside a formation are profiled as 'bounce', moving the enemies
+        as 'movement'."""
+        profiler = self.profiler
+        timed = profiler.enabled
+        if timed: start = time()
+
+        if not all(self.formations):
+            self.formations = [formation for formation in self.formations if formation]
+        formations = [formation for formation in self.formations if formation.screen == self.current_screen]
+        down_shift = 0
+        for formation in formations:
+            side = formation.step()
+            if side is not None and side != self.enemies_last_bounce_side:
+                log.debug(f'Formation hit new screen edge {self.enemies_last_bounce_side} to {side}')
+                down_shift += config.game.enemy_down_shift
+                self.enemies_last_bounce_side = side
+        if timed: start = profiler.lap('bounce', start)
+
+        for formation in formations:
+            formation.apply(down_shift)
+        if timed: start = profiler.lap('movement', start)
+
+        if down_shift and len(self.screen_enemies) > sum(len(formation) for formation in formations):
+            self.shift_enemies_down(down_shift, formations=False)
+        if timed: profiler.lap('bounce', start)
+
+
+    def shift_enemies_down(self, dy, formations=True):
+        """Moves every enemy on this screen down `dy` pixels."""
+        for enemy in self.screen_enemies:
+            if enemy.formation is not None: continue
+            enemy.y += dy
+        if formations:
+            for formation in self.formations:
+                if formation.screen == self.current_screen:
+                    formation.shift(dy)
+
+
+    def collide_stored_bullets(self):
+        """Collides the bullets the entity store moved this tick, which aren't in the
+        collision grid, then deletes those that left the screen. Bullets leaving the
+        screen still collide on their way out."""
+        if self.profiler.enabled: start = time()
+        for bullet in self.entity_store.collide(list(self.collidable_objects())):
+            # An earlier bullet's callback may have deleted this one.
+            if bullet.entity is None: continue
+            bullet.__detect_collisions_with_objects__()
+        if self.profiler.enabled: start = self.profiler.lap('collision', start)
+
+        for bullet in self.entity_store.culled():
+            bullet.delete()
+        if self.profiler.enabled: self.profiler.lap('movement', start)
+
+
+    def rebuild_collision_grid(self):
+        """Re-buckets every collidable object for this tick's broadphase."""
+        self.collision_grid.clear()
+        for obj in self.collidable_objects():
+            self.collision_grid.insert(obj)
 
 
     def draw(self):
-        """Clears and redraws the screen."""
-        self.screen.fill((0, 0, 0))
-
-        for drawable in self.drawables:
-            drawable.__draw__(self.screen)
-
-        log.debug(f'FPS is {self.clock.get_fps()}')
+        """Redraws the screen with the configured renderer."""
+        self.renderer.draw(self)
 
-        pygame.display.update()
+        if hot_log.enabled: hot_log.debug(f'FPS is {self.clock.get_fps()}')
 
 
-    def handle_events(self):
-        """Handle user input events here. Could also be used for custom events if we want."""
-        for event in pygame.event.get():
+    def handle_events(self, events=None):
+        """Handle user input events here. Could also be used for custom events if we want.
+        Handles `events` if given, otherwise everything in pygame's event queue."""
+        if events is None:
+            events = pygame.event.get()
+        if self.recorder is not None:
+            self.recorder.record(self.ticks, events)
+        for event in events:
             match event.type:
                 case pygame.QUIT:
                     self.running = False
@@ -167,6 +403,12 @@ class Game:
                     elif event.key == pygame.K_SPACE:
                         self.player.fire_bullet()
 
+                    elif event.key == config.profiler.overlay_key:
+                        self.profiler_overlay.toggle()
+
+                    elif event.key == config.profiler.trace_key:
+                        self.profiler.capture(config.profiler.capture_frames, config.profiler.trace_path, config.profiler.trace_format)
+
                 case pygame.KEYUP:
                     if event.key == pygame.K_LEFT:
                         self.player.velocity.x += 3
@@ -176,13 +418,29 @@ class Game:
 
                 case self.RELOAD:
                     self.player.loaded = True
-                    pygame.time.set_timer(self.RELOAD, 0)
+                    self.set_timer(self.RELOAD, 0)
 
                 case self.CHECKLEVEL:
                     numEnemies = len(self.visible_enemies())
                     #print(numEnemies)
                     self.attempt_update_level(numEnemies)
 
+                case self.CHANGE_SCREEN:
+                    self.change_screen(Screen(event.screen))
+
+
+    def bullet_pool_stats(self):
+        return {name: pool.stats() for name, pool in self.bullet_pools.items()}
+
+
+    def state_hash(self):
+        """SHA-256 of the gameplay state. Games that played out the same way have the same hash."""
+        state = [self.ticks, self.current_screen.name, self.score.get_content(),
+                 self.enemies_last_bounce_side, self.donePlay, self.player.loaded]
+        for obj in self.simulatables:
+            state.append((type(obj).__name__, obj.x, obj.y, *obj.velocity.components()))
+        return hashlib.sha256(repr(state).encode()).hexdigest()
+
 
     def attempt_update_level(self, ind):
         if ind == 0:
@@ -197,10 +455,14 @@ class Game:
                     if not self.donePlay:
                         self.donePlay = True
                         self.score.update(f"{int(self.score.get_content()) + 2321}")
-                        pygame.time.set_timer(self.RELOAD, 0)
+                        self.set_timer(self.RELOAD, 0)
 
 
     def generate_enemies(self, size, enemy_class, class_num, second_size=None, second_class=None, class_num_two=None):
+        """Fills the screen with a grid of enemy_class, and a second grid of second_class
+        if given. Each grid moves as one EnemyFormation."""
+        formation = EnemyFormation(self, self.current_screen)
+        self.formations.append(formation)
         for y in range(size[1]):
             for x in range(size[0]):
                 enemy_class(
@@ -208,12 +470,15 @@ class Game:
                     position=Coord(x * config.game.grid_size.x + 100, y * config.game.grid_size.y + 20),
                     valid_screens=copy.copy(self.current_screen),
                     name=f"({x}, {y})",
-                    points=config.game.enemy_points[class_num]
+                    points=config.game.enemy_points[class_num],
+                    formation=formation
                 )
 
         if second_class is None:
             return
 
+        formation = EnemyFormation(self, self.current_screen)
+        self.formations.append(formation)
         for y in range(second_size[1]):
             for x in range(second_size[0]):
                 second_class(
@@ -221,36 +486,40 @@ class Game:
                     position=Coord(x * config.game.grid_size.x + 100, y * config.game.grid_size.y + 50),
                     valid_screens=copy.copy(self.current_screen),
                     name=f"({x}, {y})",
-                    points=config.game.enemy_points[class_num_two]
+                    points=config.game.enemy_points[class_num_two],
+                    formation=formation
                 )
 
 
     def clear_enemies(self):
-        enemies_copy = copy.copy(self.enemies)
-        for e in enemies_copy:
+        # Registries allow deleting while iterating, so no copies are needed.
+        for e in self.enemies:
             e.delete()
-        del enemies_copy
+        self.fire_scheduler.clear()
+        self.formations.clear()
 
-        bullets_copy = copy.copy(self.bullets)
         for b in self.bullets:
             b.delete()
-        del bullets_copy
 
         for d in self.simulatables:
             if isinstance(d, Enemy):
                 log.warning(f'Enemy {d} still exists in simulatables after a clear?')
                 self.simulatables.remove(d)
+                self.screen_simulatables.remove(d)
             elif isinstance(d, Bullet):
                 log.warning(f'Bullet {d} still exists in simulatables after a clear?')
                 self.simulatables.remove(d)
+                self.screen_simulatables.remove(d)
 
         for d in self.drawables:
             if isinstance(d, Enemy):
                 log.warning(f'Enemy {d} still exists in drawables after a clear?')
                 self.drawables.remove(d)
+                self.screen_drawables.remove(d)
             if isinstance(d, Bullet):
                 log.warning(f'Bullet {d} still exists in drawables after a clear?')
                 self.drawables.remove(d)
+                self.screen_drawables.remove(d)
 
 
     def reload_screen_welcome(self, old_screen):
@@ -264,7 +533,7 @@ class Game:
         self.clear_enemies()
         config.music.loadMusic(self, Screen.GameOver)
         pygame.mixer.Sound.play(self.finishSound)
-        pygame.time.set_timer(self.CHECKLEVEL, 0)
+        self.set_timer(self.CHECKLEVEL, 0)
         self.clear_enemies
 
     def reload_screen_level1(self, old_screen):
@@ -275,7 +544,7 @@ class Game:
         config.music.loadMusic(self, Screen.Level1)
         self.player.sound =config.music.bullet1
         self.score.update(f"0")
-        pygame.time.set_timer(self.CHECKLEVEL, 950)
+        self.set_timer(self.CHECKLEVEL, 950)
 
 
     def reload_screen_level2(self, old_screen):
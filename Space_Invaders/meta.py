@@ -40,3 +40,61 @@ def create_logger(name, level='DEBUG'):
     # logger.addHandler(f_handler)
 
     return logger
+
+
+class HotPathLogger:
+    """A logger for code that runs every frame, where even building the message costs too much.
+
+    Guard every call with the `enabled` attribute so nothing is formatted and no
+    arguments are evaluated while it is off:
+
+        if hot_log.enabled: hot_log.debug(f'FPS is {self.clock.get_fps()}')
+
+    `enabled` is a plain attribute that set_hot_logging() flips at runtime.
+    """
+    __slots__ = ('name', 'logger', 'enabled', 'saved_levels')
+
+    def __init__(self, name, logger):
+        self.name = name
+        self.logger = logger
+        self.enabled = False
+        self.saved_levels = None
+
+
+    def debug(self, msg, *args):
+        self.logger.debug(msg, *args)
+
+
+    def info(self, msg, *args):
+        self.logger.info(msg, *args)
+
+
+hot_loggers = {}
+
+
+def create_hot_logger(name, logger):
+    """Wraps `logger`, made by create_logger(name), in a HotPathLogger that starts enabled
+    only if `name` is in config.logging.hot_path_loggers."""
+    if name.startswith('__') and name.endswith('__'):
+        name = name[2:-2]
+
+    hot_logger = HotPathLogger(name, logger)
+    hot_loggers[name] = hot_logger
+    set_hot_logging(name, name in config.logging.hot_path_loggers)
+    return hot_logger
+
+
+def set_hot_logging(name, enabled):
+    """Turns the hot-path logging of one logger on or off while the game runs.
+    Turning it on lets that logger's DEBUG messages through its handlers until it is
+    turned off again."""
+    hot_logger = hot_loggers[name]
+    if enabled and hot_logger.saved_levels is None:
+        hot_logger.saved_levels = [handler.level for handler in hot_logger.logger.handlers]
+        for handler in hot_logger.logger.handlers:
+            handler.setLevel(logging.DEBUG)
+    elif not enabled and hot_logger.saved_levels is not None:
+        for handler, level in zip(hot_logger.logger.handlers, hot_logger.saved_levels):
+            handler.setLevel(level)
+        hot_logger.saved_levels = None
+    hot_logger.enabled = enabled and hot_logger.logger.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,254 @@
+import json
+import pygame
+import config
+from timeit import default_timer as time
+from util_objects import *
+from basic_objects import Drawable
+from meta import create_logger
+
+
+log = create_logger('profiler')
+
+
+# Phases of a frame, in the order they run. They add up to the whole frame.
+FRAME_PHASES = ('handle_events', 'simulate', 'draw', 'sleep')
+# Parts of simulate, summed over every object simulated in the tick.
+SIMULATE_PHASES = ('movement', 'bounce', 'collision')
+PHASES = FRAME_PHASES + SIMULATE_PHASES
+
+
+class FrameProfiler:
+    """Times the phases of every frame while enabled.
+
+    Game wraps handle_events, simulate, draw and the Clock.tick sleep with span(),
+    and the simulation adds its movement, bounce and collision time with add() or lap().
+    The last `history` frames of every phase are kept for the overlay, and
+    capture() records the spans of the next frames to export as a trace.
+    Nothing is timed while `enabled` is False.
+    """
+
+    def __init__(self, history):
+        self.enabled = False
+        self.history = {phase: RingBuffer(history) for phase in PHASES}
+        self.frame = dict.fromkeys(PHASES, 0.0)  # seconds spent in each phase this frame
+        self.tick = dict.fromkeys(SIMULATE_PHASES, 0.0)  # simulate phases of the tick in progress
+        self.frames = 0
+        self.frame_start = None
+
+        self.spans = []  # (phase, start, end, simulate phases) of the frame, while capturing
+        self.captured = None  # (start, end, spans) of every captured frame
+        self.capture_frames = 0
+        self.capture_path = None
+        self.capture_format = None
+        self.keep_enabled = False
+
+
+    def span(self, phase, start, end):
+        """Records that `phase` ran from `start` to `end`. Phases can run more than once a frame."""
+        if self.frame_start is None:
+            self.frame_start = start
+        self.frame[phase] += end - start
+
+        tick = None
+        if phase == 'simulate':
+            tick = self.tick
+            for name, seconds in tick.items():
+                self.frame[name] += seconds
+            self.tick = dict.fromkeys(SIMULATE_PHASES, 0.0)
+        if self.captured is not None:
+            self.spans.append((phase, start, end, tick))
+
+
+    def add(self, phase, seconds):
+        """Adds time spent in one of the SIMULATE_PHASES to the tick being simulated."""
+        self.tick[phase] += seconds
+
+
+    def lap(self, phase, start):
+        """Adds the time since `start` to one of the SIMULATE_PHASES and returns now,
+        the start of the next phase."""
+        now = time()
+        self.tick[phase] += now - start
+        return now
+
+
+    def end_frame(self):
+        for phase, buffer in self.history.items():
+            buffer.put(self.frame[phase])
+            self.frame[phase] = 0.0
+        self.frames += 1
+
+        if self.captured is not None:
+            self.captured.append((self.frame_start, time(), self.spans))
+            self.spans = []
+            if len(self.captured) >= self.capture_frames:
+                self.__finish_capture__()
+        self.frame_start = None
+
+
+    def mean_ms(self, phase):
+        return self.history[phase].mean() * 1000
+
+
+    def capture(self, frames, path, trace_format='chrome'):
+        """Records the next `frames` frames and writes them to `path`, as a Chrome trace
+        (open it in chrome://tracing or Perfetto) or, with trace_format 'timeline', as
+        JSON with the milliseconds each frame spent in each phase."""
+        if trace_format not in ('chrome', 'timeline'):
+            raise ValueError(f'Unknown trace format {trace_format}, expected "chrome" or "timeline"')
+        if self.captured is not None:
+            log.warning(f'Already capturing a trace to {self.capture_path}')
+            return
+
+        self.keep_enabled = self.enabled
+        self.enabled = True
+        self.captured = []
+        self.spans = []
+        self.capture_frames = frames
+        self.capture_path = path
+        self.capture_format = trace_format
+        log.info(f'Capturing {frames} frames to {path}')
+
+
+    def __finish_capture__(self):
+        if self.capture_format == 'chrome':
+            trace = self.chrome_trace(self.captured)
+        else:
+            trace = self.timeline(self.captured)
+        with open(self.capture_path, 'w') as f:
+            json.dump(trace, f)
+        log.info(f'Wrote {len(self.captured)} frames to {self.capture_path}')
+
+        self.captured = None
+        self.enabled = self.keep_enabled
+
+
+    @staticmethod
+    def chrome_trace(frames):
+        """Chrome trace events for captured frames. The simulate phases are totals over
+        every object in a tick, so they are laid out one after the other from the start
+        of their simulate span rather than where they really happened."""
+        if not frames:
+            return {'traceEvents': []}
+        origin = frames[0][0]
+        us = lambda seconds: round((seconds - origin) * 1_000_000, 3)
+
+        def event(name, start, end, **args):
+            return {'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                    'ts': us(start), 'dur': round((end - start) * 1_000_000, 3), 'args': args}
+
+        events = []
+        for number, (start, end, spans) in enumerate(frames):
+            events.append(event('frame', start, end, frame=number))
+            for phase, span_start, span_end, tick in spans:
+                events.append(event(phase, span_start, span_end))
+                if tick is None: continue
+                at = span_start
+                for name, seconds in tick.items():
+                    events.append(event(name, at, at + seconds, summed=True))
+                    at += seconds
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+    @staticmethod
+    def timeline(frames):
+        """Milliseconds spent in each phase of every captured frame."""
+        if not frames:
+            return {'frames': []}
+        origin = frames[0][0]
+        timeline = []
+        for number, (start, end, spans) in enumerate(frames):
+            phases = dict.fromkeys(PHASES, 0.0)
+            for phase, span_start, span_end, tick in spans:
+                phases[phase] += (span_end - span_start) * 1000
+                if tick is not None:
+                    for name, seconds in tick.items():
+                        phases[name] += seconds * 1000
+            timeline.append({
+                'frame': number,
+                'start_ms': round((start - origin) * 1000, 4),
+                'frame_ms': round((end - start) * 1000, 4),
+                'phases': {phase: round(ms, 4) for phase, ms in phases.items()},
+            })
+        return {'frames': timeline}
+
+
+class ProfilerOverlay(Drawable):
+    """Rolling graph of the profiled frame phases, drawn over every screen.
+
+    Each column is one frame with its phases stacked bottom to top, the line is the
+    frame budget of config.window.fps_limit. The legend shows the mean of every phase
+    over the graphed frames.
+    """
+
+    def __init__(self, *, game, font, position=(10, 40)):
+        self.profiler = game.profiler
+        self.font = font
+        self.graph_size = config.profiler.graph_size
+        self.legend_height = font.get_linesize() * len(PHASES)
+        self.surface = None
+        self.surface_frame = None
+        super().__init__(game=game,
+                         position=position,
+                         size=(self.graph_size[0], self.graph_size[1] + self.legend_height),
+                         visible=False,
+                         valid_screens=None)
+
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.profiler.enabled = self.visible or self.profiler.captured is not None
+        self.profiler.keep_enabled = self.visible
+
+
+    def render(self):
+        """Redraws the graph once per profiled frame."""
+        if self.surface is not None and self.surface_frame == self.profiler.frames:
+            return self.surface
+
+        width, height = self.graph_size
+        surface = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        surface.fill(config.profiler.background)
+
+        budget = 1 / config.window.fps_limit
+        scale = height / (2 * budget)  # the graph shows up to two frame budgets
+        history = {phase: self.profiler.history[phase].as_list() for phase in FRAME_PHASES}
+        frames = len(history['sleep'])
+        bar_width = max(1, width // self.profiler.history['sleep'].size)
+        for column in range(frames):
+            x = width - (frames - column) * bar_width
+            if x < 0: continue
+            bottom = height
+            for phase in FRAME_PHASES:
+                bar = round(history[phase][column] * scale)
+                if bar <= 0: continue
+                top = max(0, bottom - bar)
+                pygame.draw.rect(surface, config.profiler.colours[phase], (x, top, bar_width, bottom - top))
+                bottom = top
+        budget_y = height - round(budget * scale)
+        pygame.draw.line(surface, config.profiler.budget_colour, (0, budget_y), (width, budget_y))
+
+        y = height
+        for phase in PHASES:
+            indent = '    ' if phase in SIMULATE_PHASES else ''
+            line = f'{indent}{phase} {self.profiler.mean_ms(phase):.2f} ms'
+            surface.blit(self.font.render(line, True, config.profiler.colours[phase]), (2, y))
+            y += self.font.get_linesize()
+
+        self.surface = surface
+        self.surface_frame = self.profiler.frames
+        return surface
+
+
+    def render_state(self):
+        return ((self.x, self.y, self.width, self.height), self.render())
+
+
+    def blit_item(self):
+        return (self.render(), (self.x, self.y))
+
+
+    def __draw__(self, screen):
+        if not self.visible: return False
+        screen.blit(self.render(), (self.x, self.y))
+        return True
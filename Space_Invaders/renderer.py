@@ -0,0 +1,135 @@
+import pygame
+import config
+from util_objects import *
+from meta import create_logger
+
+
+log = create_logger('renderer')
+
+
+def draw_in_order(screen, drawables):
+    """Draws drawables in order, handing runs of them that have a blit_item to a single
+    Surface.blits call instead of blitting them one by one."""
+    batch = []
+    for drawable in drawables:
+        if not drawable.visible: continue
+        item = drawable.blit_item()
+        if item is not None:
+            batch.append(item)
+            continue
+        # Drawn by itself, so flush what is underneath it first.
+        if batch:
+            screen.blits(batch, doreturn=False)
+            batch = []
+        drawable.__draw__(screen)
+    if batch:
+        screen.blits(batch, doreturn=False)
+
+
+class FullRenderer:
+    """Clears the screen and redraws every drawable each frame, one Surface.blits
+    call per layer."""
+
+    def draw(self, game):
+        game.screen.fill((0, 0, 0))
+
+        for layer, drawables in game.screen_drawables.layers():
+            draw_in_order(game.screen, drawables)
+
+        pygame.display.update()
+
+
+class DirtyRenderer(FullRenderer):
+    """Only repaints the parts of the screen that changed since the last frame.
+
+    Every drawable reports a render state, its screen rect and whatever else
+    changes its pixels. Regions of drawables that moved, changed, appeared or
+    disappeared are restored from a cached copy of the screen's backgrounds, the
+    drawables overlapping them are drawn again, and only those rects are passed to
+    `pygame.display.update`. Frames with a drawable that can't report its state
+    (the menu screens) and screen changes fall back to a full redraw.
+    """
+
+    def __init__(self):
+        # id(drawable) -> (rect, token). Holding the token, usually the surface drawn,
+        # keeps its id from being reused by a new surface.
+        self.previous = {}
+        self.background = None
+        self.background_screen = None
+
+
+    def __cache_background__(self, game, backgrounds):
+        self.background = pygame.Surface(config.window.size).convert()
+        self.background.fill((0, 0, 0))
+        for background in backgrounds:
+            background.__draw__(self.background)
+        self.background_screen = game.current_screen
+
+
+    def full_draw(self, game, states):
+        super().draw(game)
+        self.previous = states
+
+
+    def draw(self, game):
+        backgrounds = []
+        sprites = []
+        states = {}
+        for drawable in game.screen_drawables:
+            if not drawable.visible: continue
+            if drawable.layer is Layer.Background:
+                backgrounds.append(drawable)
+                continue
+
+            state = drawable.render_state()
+            if state is None:
+                self.background_screen = None
+                self.full_draw(game, {})
+                return
+            sprites.append(drawable)
+            states[id(drawable)] = state
+
+        if self.background_screen != game.current_screen:
+            self.__cache_background__(game, backgrounds)
+            self.full_draw(game, states)
+            return
+
+        dirty = []
+        previous = self.previous
+        for key, state in states.items():
+            old_state = previous.pop(key, None)
+            if old_state == state: continue
+            if old_state is not None:
+                dirty.append(Rect(*old_state[0]))
+            dirty.append(Rect(*state[0]))
+        # Whatever is left was deleted or hidden since the last frame.
+        for rect, _ in previous.values():
+            dirty.append(Rect(*rect))
+        self.previous = states
+
+        if not dirty:
+            return
+
+        # Each region is restored and redrawn clipped to itself, so drawables that only
+        # partly overlap it aren't blended over their own pixels outside of it.
+        screen = game.screen
+        sprite_rects = [Rect(*states[id(drawable)][0]) for drawable in sprites]
+        for rect in dirty:
+            screen.set_clip(rect)
+            screen.blit(self.background, rect, rect)
+            draw_in_order(screen, [sprites[index] for index in rect.collidelistall(sprite_rects)])
+        screen.set_clip(None)
+
+        pygame.display.update(dirty)
+
+
+def create_renderer(kind):
+    match kind:
+        case 'full':
+            renderer = FullRenderer()
+        case 'dirty':
+            renderer = DirtyRenderer()
+        case other:
+            raise ValueError(f'Unknown renderer {other}, expected "full" or "dirty"')
+    log.info(f'Drawing with the {kind} renderer')
+    return renderer
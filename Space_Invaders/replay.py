@@ -0,0 +1,129 @@
+"""Recording games and replaying them headless.
+
+A recording is the game's seed and every event it handled, keyed by the simulation
+tick it was handled on. Everything else the game does follows from those, so a
+replay ends with the same score and Game.state_hash() as the recorded game.
+
+Record by setting config.replay.record, then replay as fast as possible with:
+    python replay.py recording.json
+"""
+import sys
+import json
+import argparse
+import pygame
+from timeit import default_timer as time
+from meta import create_logger
+
+
+log = create_logger('replay')
+
+
+FORMAT_VERSION = 1
+
+
+def encode_event(game, event):
+    """A JSON-able copy of a pygame event. The game's custom events are stored by
+    name, attributes that aren't plain values (like the window) are dropped."""
+    names = {event_type: name for name, event_type in game.custom_events.items()}
+    attributes = {key: value for key, value in event.dict.items()
+                  if value is None or isinstance(value, (bool, int, float, str))}
+    return [names.get(event.type, event.type), attributes]
+
+
+def decode_event(game, data):
+    event_type, attributes = data
+    if isinstance(event_type, str):
+        event_type = game.custom_events[event_type]
+    return pygame.event.Event(event_type, **attributes)
+
+
+class Recorder:
+    """Records the events a game handles, see Game.handle_events."""
+
+    def __init__(self, game, path=None):
+        self.game = game
+        self.path = path
+        self.events = []  # [tick, [event, ...]] in tick order
+
+
+    def record(self, tick, events):
+        if not events: return
+        encoded = [encode_event(self.game, event) for event in events]
+        if self.events and self.events[-1][0] == tick:
+            self.events[-1][1].extend(encoded)
+        else:
+            self.events.append([tick, encoded])
+
+
+    def recording(self):
+        """The recording so far, ending with the game's current score and state hash."""
+        return {
+            'version': FORMAT_VERSION,
+            'seed': self.game.seed,
+            'ticks': self.game.ticks,
+            'events': self.events,
+            'score': self.game.score.get_content(),
+            'state_hash': self.game.state_hash(),
+        }
+
+
+    def save(self, path=None):
+        path = path or self.path
+        with open(path, 'w') as f:
+            json.dump(self.recording(), f)
+        log.info(f'Recorded {self.game.ticks} ticks to {path}')
+
+
+def load(path):
+    with open(path) as f:
+        recording = json.load(f)
+    if recording.get('version') != FORMAT_VERSION:
+        raise ValueError(f'{path} is a version {recording.get("version")} recording, expected version {FORMAT_VERSION}')
+    return recording
+
+
+def replay(recording):
+    """Plays a recording in a new headless game as fast as possible and returns the game.
+
+    The recorded events are handled on the ticks they were recorded on, timer events
+    included, so the game's own headless timers are never consulted.
+    """
+    import main
+
+    game = main.Game(headless=True, seed=recording['seed'])
+    game.setup()
+
+    events = {tick: [decode_event(game, data) for data in tick_events] for tick, tick_events in recording['events']}
+    # Keeps going after a quit like Game.run does, which finishes the frame it quit in.
+    while game.ticks < recording['ticks']:
+        game.handle_events(events.get(game.ticks, []))
+        game.simulate()
+    game.handle_events(events.get(game.ticks, []))
+    return game
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='a recording saved by replay.Recorder')
+    args = parser.parse_args(argv)
+
+    recording = load(args.recording)
+    start = time()
+    game = replay(recording)
+    seconds = time() - start
+
+    score = game.score.get_content()
+    state_hash = game.state_hash()
+    print(f'Replayed {game.ticks} ticks in {seconds:.2f}s ({game.ticks / max(seconds, 1e-9):.0f} ticks/s)')
+    print(f'Score {score}, recorded {recording["score"]}')
+    print(f'State hash {state_hash}')
+    pygame.quit()
+
+    if score != recording['score'] or state_hash != recording['state_hash']:
+        print(f'Replay diverged, recorded state hash was {recording["state_hash"]}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
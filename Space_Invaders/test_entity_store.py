@@ -0,0 +1,68 @@
+import pytest
+from util_objects import *
+
+np = pytest.importorskip('numpy')
+from entity_store import EntityStore
+
+
+class Entity(Rect):
+    def __init__(self, x, y, velocity, collision_layer=CollisionLayer.EnemyBullets):
+        super().__init__(x, y, 10, 10)
+        self.velocity = velocity
+        self.collision_layer = collision_layer
+        self.valid_screens = Screen.Level1
+        self.simulating = True
+        self.entity = None
+        self.mover = None
+
+
+class Profiler:
+    enabled = False
+
+
+class Game:
+    def __init__(self):
+        self.profiler = Profiler()
+        self.current_screen = Screen.Level1
+
+
+def test_moves_and_culls_bullets_off_screen():
+    store = EntityStore(1)
+    leaving = Entity(100, 5, CartesianVelocity(0, -10))
+    staying = Entity(200, 300, CartesianVelocity(3, 10))
+    other_screen = Entity(300, 5, CartesianVelocity(0, -10))
+    other_screen.valid_screens = Screen.Level2
+    for obj in (leaving, staying, other_screen):
+        store.add(obj)
+
+    store.simulate(Game())
+    assert (leaving.x, leaving.y) == (100, -5)
+    assert (leaving.last_x, leaving.last_y) == (100, 5)
+    assert (staying.x, staying.y) == (203, 310)
+    assert (other_screen.x, other_screen.y) == (300, 5)
+    assert store.culled() == [leaving]
+
+    # Removing hands back a plain velocity and frees the slot.
+    store.remove(leaving)
+    assert store.culled() == []
+    assert leaving.velocity.components() == (0, -10)
+    assert len(store) == 2
+
+
+def test_collide_finds_targets_passed_over():
+    store = EntityStore(4)
+    tunnelling = Entity(100, 200, CartesianVelocity(0, -100))
+    missing = Entity(300, 200, CartesianVelocity(0, -100))
+    wrong_layer = Entity(100, 200, CartesianVelocity(0, -100), CollisionLayer.PlayerBullets)
+    for obj in (tunnelling, missing, wrong_layer):
+        store.add(obj)
+    target = Rect(90, 140, 40, 5)
+    target.collision_layer = CollisionLayer.Player
+
+    store.simulate(Game())
+    # Only passed over on the way from y 200 to 100, player bullets don't hit the player.
+    assert not tunnelling.colliderect(target)
+    assert store.collide([target]) == [tunnelling]
+    assert store.collide([]) == []
+    # With more targets than bullets, boxing the targets isn't worth it.
+    assert store.collide([target] * 4) == [tunnelling, missing, wrong_layer]
@@ -0,0 +1,165 @@
+import pytest
+from game_objects import *
+
+
+def make_enemy(game, screen=Screen.Level1, fire_chance=1, **kwargs):
+    return Enemy(10, game=game, bullet_speed=5, fire_chance=fire_chance,
+                 valid_screens=screen, position=Coord(100, 100), size=Coord(40, 40), **kwargs)
+
+
+def test_fire_scheduler_drops_deleted_enemies(game):
+    game.change_screen(Screen.Level1)
+    game.clear_enemies()
+    scheduler = game.fire_scheduler
+    firing = make_enemy(game)
+    deleted = make_enemy(game)
+    assert len(scheduler) == 2
+
+    deleted.delete()
+    game.ticks += 1
+    assert scheduler.due() == [firing]
+    # Only the enemy that fired is back in the heap.
+    assert len(scheduler) == 1
+    assert firing.next_fire == game.ticks + 1
+
+
+def test_fire_scheduler_reschedules_enemies_not_simulated(game):
+    game.change_screen(Screen.Level1)
+    game.clear_enemies()
+    scheduler = game.fire_scheduler
+    other_screen = make_enemy(game, screen=Screen.Level2)
+    paused = make_enemy(game, simulating=False)
+
+    game.ticks += 1
+    assert scheduler.due() == []
+    assert len(scheduler) == 2
+    assert other_screen.next_fire == paused.next_fire == game.ticks + 1
+
+
+def test_fire_scheduler_clear(game):
+    game.change_screen(Screen.Level1)
+    scheduler = game.fire_scheduler
+    make_enemy(game)
+    assert len(scheduler) > 0
+
+    scheduler.clear()
+    assert len(scheduler) == 0
+    game.ticks += 1
+    assert scheduler.due() == []
+
+
+def test_bullet_pool(game):
+    game.change_screen(Screen.Level1)
+    pool = BulletPool(game, 2)
+    shot = dict(source=game.player, position=(100, 500), velocity=(0, -10), img=config.game.bullet_img)
+    bullets = [pool.acquire(**shot) for i in range(3)]
+    assert pool.stats() == {'size': 3, 'free': 0, 'in_use': 3, 'peak_in_use': 3, 'acquired': 3, 'exhausted': 1}
+    assert all(bullet in game.bullets for bullet in bullets)
+
+    # Hitting something as it leaves the screen deletes a bullet twice in one tick.
+    bullets[0].delete()
+    bullets[0].delete()
+    assert bullets[0] not in game.bullets
+    assert pool.stats() == {'size': 3, 'free': 1, 'in_use': 2, 'peak_in_use': 3, 'acquired': 3, 'exhausted': 1}
+
+    velocity = bullets[0].velocity
+    enemy_shot = dict(source=None, position=(200, 100), velocity=(0, 5), img=config.game.bullet_enemy_img[0])
+    reused = pool.acquire(**enemy_shot)
+    assert reused is bullets[0]
+    if game.entity_store is None:
+        assert reused.velocity is velocity
+    assert reused.velocity.components() == (0, 5)
+    assert (reused.x, reused.y) == (200, 100)
+    assert reused.img is sprite_cache.scale(config.game.bullet_enemy_img[0], reused.size)
+    assert reused.collision_layer == CollisionLayer.EnemyBullets
+    assert pool.stats()['exhausted'] == 1
+
+    # Reused for the same image, the bullet keeps its sprite instead of scaling again.
+    sprite = reused.img
+    reused.delete()
+    scaled = []
+    scale = sprite_cache.scale
+    sprite_cache.scale = lambda *args, **kwargs: scaled.append(args) or scale(*args, **kwargs)
+    try:
+        assert pool.acquire(**enemy_shot) is reused
+    finally:
+        del sprite_cache.scale
+    assert scaled == []
+    assert reused.img is sprite
+
+
+def test_emptied_formation(game):
+    game.change_screen(Screen.Level2)
+    emptied = game.formations[1]
+    for enemy in emptied.members:
+        enemy.delete()
+
+    assert game.step(2) == 2
+    assert emptied not in game.formations
+    emptied.apply(10)
+    emptied.shift(10)
+
+
+def make_formation(game, positions):
+    game.change_screen(Screen.Level1)
+    game.clear_enemies()
+    formation = EnemyFormation(game, Screen.Level1)
+    game.formations.append(formation)
+    enemies = [make_enemy(game, fire_chance=0, formation=formation, velocity=CartesianVelocity(4, 0))
+               for position in positions]
+    for enemy, (x, y) in zip(enemies, positions):
+        enemy.x, enemy.y = x, y
+    formation.bounds_stale = True
+    return formation, enemies
+
+
+def test_formation_bounce_shifts_down(game):
+    right_edge = config.window.size[0]
+    formation, enemies = make_formation(game, [(right_edge - 100, 100), (right_edge - 42, 100)])
+    game.enemies_last_bounce_side = None
+
+    game.move_formations()
+    assert game.enemies_last_bounce_side == 'right'
+    assert formation.velocity.x == -4
+    down_shift = config.game.enemy_down_shift
+    assert [(enemy.x, enemy.y) for enemy in enemies] == [(right_edge - 96, 100 + down_shift), (right_edge - 38, 100 + down_shift)]
+    assert (formation.top, formation.bottom) == (100 + down_shift, 140 + down_shift)
+
+    # The same side again doesn't move them down twice.
+    game.move_formations()
+    assert enemies[0].y == 100 + down_shift
+
+
+def test_formation_bounds_after_removal(game):
+    formation, enemies = make_formation(game, [(100, 100), (300, 200)])
+    formation.step()
+    assert (formation.left, formation.top, formation.right, formation.bottom) == (104, 100, 344, 240)
+    formation.apply()
+
+    enemies[1].delete()
+    formation.step()
+    assert (formation.left, formation.top, formation.right, formation.bottom) == (108, 100, 148, 140)
+
+
+def test_formation_phases_profiled(game):
+    make_formation(game, [(100, 100), (300, 200)])
+    game.profiler.enabled = True
+
+    game.move_formations()
+    assert game.profiler.tick['bounce'] > 0
+    assert game.profiler.tick['movement'] > 0
+
+
+def test_store_bullet_hits_on_its_way_off_screen(game):
+    entity_store = pytest.importorskip('entity_store')
+    game.change_screen(Screen.Level1)
+    game.clear_enemies()
+    enemy = make_enemy(game, fire_chance=0)
+    enemy.x, enemy.y = 300, 40
+    game.entity_store = entity_store.EntityStore(16)
+    bullet = Bullet(game=game, source=game.player, position=Coord(300, 150), velocity=CartesianVelocity(0, -200))
+    assert bullet.mover is game.entity_store
+
+    game.simulate()
+    assert enemy not in game.enemies
+    assert bullet not in game.bullets
@@ -0,0 +1,17 @@
+import pygame
+import replay
+from util_objects import *
+
+
+def test_replays_match_in_one_process(game):
+    game.recorder = replay.Recorder(game)
+    fire = pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE)
+    inputs = [[fire] if tick % 5 == 0 else [] for tick in range(1500)]
+    inputs[0] = [pygame.event.Event(game.CHANGE_SCREEN, screen=Screen.Level1.value)]
+    game.step(len(inputs), inputs)
+    recording = game.recorder.recording()
+
+    for attempt in range(2):
+        replayed = replay.replay(recording)
+        assert replayed.score.get_content() == recording['score']
+        assert replayed.state_hash() == recording['state_hash']
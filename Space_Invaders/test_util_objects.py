@@ -179,20 +179,251 @@ def test_abs():
     assert res.y == 5
 
 
-def test_dropping_stack():
-    a = DroppingStack(3)
-    assert a.arr == []
+def test_spatial_hash_nearby():
+    grid = SpatialHash(50)
+    a = Rect(0, 0, 40, 40)
+    b = Rect(30, 30, 40, 40)
+    c = Rect(300, 300, 40, 40)
+    for r in (a, b, c):
+        grid.insert(r)
+
+    assert grid.nearby(a) == [a, b]
+    assert grid.nearby(c) == [c]
+
+    c.x = 20
+    c.y = 20
+    grid.update(c)
+    assert grid.nearby(a) == [a, b, c]
+
+    assert grid.remove(b)
+    assert not grid.remove(b)
+    assert b not in grid
+    assert grid.nearby(a) == [a, c]
+
+
+def test_cartesian_velocity_polar_view():
+    v = CartesianVelocity(scalar=1, degrees=60)
+    assert v.x == pytest.approx(0.5)
+    assert v.y == pytest.approx(sqrt(3)/2)
+    assert v.degrees == pytest.approx(60)
 
-    a.put(3)
-    assert a.arr == [3], a.arr
+    v.flip_x()
+    assert v.degrees == pytest.approx(120)
 
-    a.put(2)
+    v.flip_y()
+    assert v.x == pytest.approx(-0.5)
+    assert v.y == pytest.approx(-sqrt(3)/2)
+    assert v.degrees == pytest.approx(240)
+    assert v.scalar == pytest.approx(1)
+
+
+def test_cartesian_velocity_components():
+    v = CartesianVelocity(x_y=(3, 4))
+    assert v.scalar == 5
+
+    v.x -= 3
+    assert v.components() == (0, 4)
+    assert v.degrees == pytest.approx(90)
+
+    v.radians = radians(180)
+    assert v.x == pytest.approx(-4)
+    assert v.y == pytest.approx(0)
+
+
+class ScreenObject:
+    def __init__(self, valid_screens):
+        self.valid_screens = valid_screens
+
+
+def test_screen_buckets():
+    buckets = ScreenBuckets()
+    everywhere = ScreenObject(None)
+    welcome = ScreenObject(Screen.Welcome)
+    levels = ScreenObject((Screen.Level1, Screen.Level2))
+    for obj in (welcome, everywhere, levels):
+        buckets.add(obj)
+
+    assert list(buckets) == [welcome, everywhere]
+    buckets.switch(Screen.Level2)
+    assert list(buckets) == [everywhere, levels]
+
+    buckets.remove(everywhere)
+    assert list(buckets) == [levels]
+    buckets.switch(Screen.Welcome)
+    assert list(buckets) == [welcome]
+
+
+def test_layered_screen_buckets():
+    buckets = LayeredScreenBuckets()
+    hud = ScreenObject(None)
+    hud.layer = Layer.HUD
+    background = ScreenObject(Screen.Welcome)
+    background.layer = Layer.Background
+    enemy = ScreenObject(Screen.Welcome)
+    enemy.layer = Layer.Enemies
+    for obj in (hud, enemy, background):
+        buckets.add(obj)
+
+    assert list(buckets) == [background, enemy, hud]
+    assert [list(bucket) for layer, bucket in buckets.layers() if len(bucket)] == [[background], [enemy], [hud]]
+
+    buckets.switch(Screen.Level1)
+    assert list(buckets) == [hud]
+    buckets.remove(hud)
+    buckets.switch(Screen.Welcome)
+    assert list(buckets) == [background, enemy]
+
+
+def test_registry_remove_while_iterating():
+    items = [Coord(i, i) for i in range(6)]
+    registry = Registry(items)
+    added = Coord(9, 9)
+
+    seen = []
+    for item in registry:
+        seen.append(item)
+        if item is items[1]:
+            assert registry.remove(items[2])
+            assert registry.remove(items[0])
+            registry.add(added)
+
+    assert seen == [items[0], items[1], items[3], items[4], items[5], added]
+    assert list(registry) == [items[1], items[3], items[4], items[5], added]
+    assert len(registry) == 5
+    assert items[2] not in registry
+    assert not registry.remove(items[2])
+
+
+def test_registry_compacts():
+    items = [Coord(i, i) for i in range(10)]
+    registry = Registry(items)
+    for item in items[:6]:
+        registry.remove(item)
+
+    assert len(registry.slots) == 4
+    assert list(registry) == items[6:]
+
+
+def test_ring_buffer():
+    a = RingBuffer(3)
+    assert a.mean() == 0
+    assert a.max() == 0
+
+    a.put(3)
     a.put(1)
-    assert a.arr == [3,2,1], a.arr
+    assert a.as_list() == [3, 1]
+    assert a.mean() == 2
+    assert a.max() == 3
 
+    a.put(2)
     a.put(0)
-    assert a.arr == [2,1,0], a.arr
+    assert a.as_list() == [1, 2, 0]
+    assert a.mean() == 1
+    assert a.max() == 2
+    assert a.percentile(0) == 0
+    assert a.percentile(0.5) == 1
+    assert a.percentile(1) == 2
 
     a.put(-1)
-    assert a.arr == [1,0,-1], a.arr
-
+    a.put(-2)
+    assert a.as_list() == [0, -1, -2]
+    assert a.max() == 0
+
+
+def test_trials_until_success():
+    import random
+    rng = random.Random(0)
+    assert trials_until_success(rng, 0) is None
+    assert trials_until_success(rng, 1) == 1
+
+    draws = [trials_until_success(rng, 0.01) for i in range(20000)]
+    assert min(draws) >= 1
+    assert 95 < sum(draws) / len(draws) < 105
+
+
+def test_masks_overlap():
+    a = Rect(0, 0, 4, 4)
+    b = Rect(2, 2, 4, 4)
+    corner = Mask((4, 4))
+    corner.set_at((0, 0))
+    assert masks_overlap(a, None, b, None)
+    assert not masks_overlap(a, corner, b, corner)
+    assert not masks_overlap(a, corner, b, None)
+
+    corner.set_at((2, 2))
+    assert masks_overlap(a, corner, b, corner)
+    assert masks_overlap(b, None, a, corner)
+
+
+class LayeredObject(Rect):
+    def __init__(self, layer, *rect):
+        super().__init__(*rect)
+        self.collision_layer = layer
+
+
+def test_layered_spatial_hash():
+    matrix = {
+        CollisionLayer.Player: CollisionLayer.EnemyBullets,
+        CollisionLayer.EnemyBullets: CollisionLayer.Player,
+        CollisionLayer.Enemies: CollisionLayer(0),
+    }
+    grid = LayeredSpatialHash(50, matrix)
+    player = LayeredObject(CollisionLayer.Player, 0, 0, 40, 40)
+    bullet = LayeredObject(CollisionLayer.EnemyBullets, 10, 10, 40, 40)
+    enemy = LayeredObject(CollisionLayer.Enemies, 20, 20, 40, 40)
+    other_enemy = LayeredObject(CollisionLayer.Enemies, 30, 30, 40, 40)
+    for obj in (player, bullet, enemy, other_enemy):
+        grid.insert(obj)
+
+    assert grid.nearby(player) == [bullet]
+    assert grid.nearby(bullet) == [player]
+    assert grid.nearby(enemy) == []
+    assert len(grid) == 4
+
+    assert grid.remove(bullet)
+    assert bullet not in grid
+    assert grid.nearby(player) == []
+
+    with pytest.raises(ValueError):
+        LayeredSpatialHash(50, {CollisionLayer.Player: CollisionLayer.Enemies})
+
+
+def test_swept_aabb():
+    bullet = Rect(0, 100, 4, 10)
+    enemy = Rect(0, 40, 40, 40)
+
+    # Moving 100px up in one tick passes straight through the enemy.
+    assert not bullet.move(0, -100).colliderect(enemy)
+    entry, exit = swept_aabb(bullet, 0, -100, enemy)
+    assert entry == pytest.approx(0.2)
+    assert exit == pytest.approx(0.7)
+
+    assert swept_aabb(bullet, 0, -10, enemy) is None
+    assert swept_aabb(bullet, 0, 100, enemy) is None
+    assert swept_aabb(bullet.move(40, 0), 0, -100, enemy) is None
+    assert swept_aabb(bullet.move(0, -50), 0, 0, enemy) == (0.0, 1.0)
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    assert cache.get('a') is None
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    # 'b' is now the least recently used.
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 2, 'misses': 2}
+
+    source, other = Coord(0, 0), Coord(0, 0)
+    cache.put(id(source), 'scaled', source)
+    assert cache.get(id(source), source) == 'scaled'
+    assert cache.get(id(source), other) is None
+    assert cache.get(id(source)) is None
+
+
+def test_solid_mask_is_shared():
+    assert solid_mask((4, 4)) is solid_mask((4, 4))
+    assert solid_mask((4, 4)).count() == 16
@@ -2,9 +2,11 @@ import math
 # import config Cannot use config in this file. Config is based on this file
 from timeit import default_timer as time
 from time import sleep
-from enum import Enum, auto
+from enum import Enum, Flag, auto
 import copy
+from collections import deque, OrderedDict
 from pygame import Rect as PyGameRect
+from pygame.mask import Mask
 
 
 class Screen(Enum):
@@ -15,6 +17,293 @@ class Screen(Enum):
     GameOver = auto()
 
 
+class Registry:
+    """An insertion-ordered collection with O(1) add, membership and removal by identity.
+
+    Objects sit in the slots of a list and are found through an id() index, so
+    nothing relies on `__eq__`. Removing an object empties its slot; the slots are
+    compacted once half of them are empty and nothing is iterating. That makes it
+    safe to add and remove objects while iterating: removed objects are skipped and
+    added ones are visited, like appending to a list being looped over.
+    """
+
+    def __init__(self, objects=()):
+        self.slots = []
+        self.index = {}  # id(obj) -> slot
+        self.iterating = 0
+        for obj in objects:
+            self.add(obj)
+
+
+    def add(self, obj):
+        if id(obj) in self.index: return False
+        self.index[id(obj)] = len(self.slots)
+        self.slots.append(obj)
+        return True
+
+
+    def remove(self, obj):
+        slot = self.index.pop(id(obj), None)
+        if slot is None: return False
+        self.slots[slot] = None
+        if not self.iterating:
+            self.__compact__()
+        return True
+
+
+    def clear(self):
+        self.index.clear()
+        if self.iterating:
+            self.slots[:] = [None] * len(self.slots)
+        else:
+            self.slots.clear()
+
+
+    def __compact__(self):
+        if len(self.slots) - len(self.index) <= len(self.slots) // 2: return
+        self.slots = [obj for obj in self.slots if obj is not None]
+        for slot, obj in enumerate(self.slots):
+            self.index[id(obj)] = slot
+
+
+    def __contains__(self, obj):
+        return id(obj) in self.index
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def __iter__(self):
+        self.iterating += 1
+        try:
+            slots = self.slots
+            i = 0
+            while i < len(slots):
+                obj = slots[i]
+                i += 1
+                if obj is not None:
+                    yield obj
+        finally:
+            self.iterating -= 1
+            if not self.iterating:
+                self.__compact__()
+
+
+class LRUCache:
+    """The `max_size` most recently used values, counting hits and misses for stats().
+
+    Keys built from an id() are put with the object they came from as `source`, and
+    get() only matches while the same object is passed again. The entry keeps the
+    object alive, so its id can't be reused while cached.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (source, value)
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def get(self, key, source=None):
+        """The value cached for `key`, or None."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] is not source:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+
+    def put(self, key, value, source=None):
+        self.entries[key] = (source, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return value
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+    def stats(self):
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class Layer(Enum):
+    """Drawing order, from the back of the screen to the front."""
+    Background = auto()
+    Enemies = auto()
+    Bullets = auto()
+    Player = auto()
+    HUD = auto()
+    UI = auto()
+
+
+class CollisionLayer(Flag):
+    """What an object is to the collision pass. Which layers test each other is
+    config.game.collision_matrix, see LayeredSpatialHash."""
+    Player = auto()
+    PlayerBullets = auto()
+    Enemies = auto()
+    EnemyBullets = auto()
+    Other = auto()
+
+
+def screens_of(valid_screens):
+    """The screens an object with this `valid_screens` value is shown and simulated on."""
+    if valid_screens is None:
+        return tuple(Screen)
+    if isinstance(valid_screens, Screen):
+        return (valid_screens,)
+    return tuple(valid_screens)
+
+
+def trials_until_success(random, chance):
+    """How many tries it takes to first succeed when each one succeeds with `chance`,
+    counting the successful one. Drawn from the geometric distribution with a single
+    number from `random`, a random.Random. None if `chance` is 0."""
+    if chance <= 0: return None
+    if chance >= 1: return 1
+    return int(math.log(1.0 - random.random()) / math.log1p(-chance)) + 1
+
+
+def swept_aabb(rect, dx, dy, other):
+    """When `rect`, moving by (dx, dy), starts and stops overlapping the still `other`,
+    as fractions (entry, exit) of the move with 0 <= entry < exit <= 1. None if they
+    don't overlap during the move. Like colliderect, touching edges don't overlap."""
+    entry, exit = 0.0, 1.0
+    for start, size, delta, other_start, other_size in ((rect.x, rect.width, dx, other.x, other.width),
+                                                        (rect.y, rect.height, dy, other.y, other.height)):
+        # Overlapping on this axis while low < start + delta * t < high.
+        low = other_start - size
+        high = other_start + other_size
+        if delta == 0:
+            if not low < start < high: return None
+            continue
+        t0 = (low - start) / delta
+        t1 = (high - start) / delta
+        if t0 > t1:
+            t0, t1 = t1, t0
+        entry = max(entry, t0)
+        exit = min(exit, t1)
+        if entry >= exit: return None
+    return (entry, exit)
+
+
+solid_masks = {}  # size -> fully set Mask
+
+
+def solid_mask(size):
+    """A shared mask of `size` with every bit set. Never change it."""
+    mask = solid_masks.get(size)
+    if mask is None:
+        mask = solid_masks[size] = Mask(size, fill=True)
+    return mask
+
+
+def masks_overlap(rect, mask, other_rect, other_mask):
+    """Whether two objects share an opaque pixel, each drawn with its `mask` at the top
+    left of its rect. A mask of None stands for a fully opaque rect. Only worth asking
+    once the rects are known to overlap."""
+    if mask is None:
+        if other_mask is None: return True
+        rect, mask, other_rect, other_mask = other_rect, other_mask, rect, mask
+    if other_mask is None:
+        other_mask = solid_mask((other_rect.width, other_rect.height))
+    return mask.overlap(other_mask, (other_rect.x - rect.x, other_rect.y - rect.y)) is not None
+
+
+class ScreenBuckets:
+    """Objects grouped by the screens they are valid on.
+
+    Iterating only walks the active screen's bucket, and switching screens just
+    swaps which bucket is active. Objects valid on every screen are added to every
+    bucket so each bucket keeps the order objects were added in.
+    """
+
+    def __init__(self, screen=Screen.Welcome):
+        self.buckets = {s: Registry() for s in Screen}
+        self.active = self.buckets[screen]
+
+
+    def add(self, obj):
+        for screen in screens_of(obj.valid_screens):
+            self.buckets[screen].add(obj)
+
+
+    def remove(self, obj):
+        for screen in screens_of(obj.valid_screens):
+            self.buckets[screen].remove(obj)
+
+
+    def switch(self, screen):
+        self.active = self.buckets[screen]
+
+
+    def __contains__(self, obj):
+        return obj in self.active
+
+
+    def __len__(self):
+        return len(self.active)
+
+
+    def __iter__(self):
+        # The screen can change while iterating, skip whatever isn't on the new one.
+        for obj in self.active:
+            if obj in self.active:
+                yield obj
+
+
+class LayeredScreenBuckets(ScreenBuckets):
+    """ScreenBuckets that also split each screen's objects by their `layer`.
+
+    Iterating walks the active screen's layers from back to front, and each layer
+    in the order its objects were added, so it is the order to draw them in.
+    """
+
+    def __init__(self, screen=Screen.Welcome):
+        super().__init__(screen)
+        self.layer_buckets = {s: {layer: Registry() for layer in Layer} for s in Screen}
+        self.active_layers = self.layer_buckets[screen]
+
+
+    def add(self, obj):
+        super().add(obj)
+        for screen in screens_of(obj.valid_screens):
+            self.layer_buckets[screen][obj.layer].add(obj)
+
+
+    def remove(self, obj):
+        super().remove(obj)
+        for screen in screens_of(obj.valid_screens):
+            self.layer_buckets[screen][obj.layer].remove(obj)
+
+
+    def switch(self, screen):
+        super().switch(screen)
+        self.active_layers = self.layer_buckets[screen]
+
+
+    def layers(self):
+        """(Layer, Registry) pairs of the active screen, from back to front."""
+        return self.active_layers.items()
+
+
+    def __iter__(self):
+        for bucket in self.active_layers.values():
+            for obj in bucket:
+                if obj in self.active:
+                    yield obj
+
+
 class Coord:
     def __init__(self, x, y):
         self.x = x
@@ -163,15 +452,301 @@ class Velocity:
             return 3
 
 
-class DroppingStack:
+class CartesianVelocity:
+    """A velocity stored as its x and y components.
+
+    Reading and writing components is a plain attribute access, which is what the
+    simulation does every frame. The polar view (`scalar`, `radians`, `degrees`) is
+    only computed when asked for and follows the same angle and quadrant rules as
+    `Velocity`.
+    """
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x=0, y=0, *, x_y=None, scalar=None, radians=None, degrees=None):
+        if x_y is not None:
+            x, y = x_y
+        elif scalar is not None:
+            if radians is None:
+                radians = math.radians(degrees or 0)
+            x = math.cos(radians) * scalar
+            y = math.sin(radians) * scalar
+        self.x = x
+        self.y = y
+
+
+    @classmethod
+    def from_velocity(cls, velocity):
+        return cls(*velocity.components())
+
+
+    @property
+    def scalar(self):
+        return Velocity.scalar_from_components(self.x, self.y)
+
+
+    @scalar.setter
+    def scalar(self, new_scalar):
+        self.set_polar(new_scalar, self.radians)
+
+
+    @property
+    def radians(self):
+        return Velocity.angle_from_components(self.x, self.y)
+
+
+    @radians.setter
+    def radians(self, new_radians):
+        self.set_polar(self.scalar, new_radians)
+
+
+    @property
+    def degrees(self):
+        return math.degrees(self.radians)
+
+
+    def set_polar(self, scalar, radians):
+        self.x = math.cos(radians) * scalar
+        self.y = math.sin(radians) * scalar
+
+
+    def __repr__(self):
+        return f"{round(self.scalar,2)} @ {round(self.degrees,2)}°"
+
+
+    def __str__(self):
+        return self.__repr__()
+
+
+    def flip_x(self):
+        self.x = -self.x
+
+
+    def flip_y(self):
+        self.y = -self.y
+
+
+    def from_components(self, x, y):
+        self.x = x
+        self.y = y
+
+
+    def components(self):
+        return (self.x, self.y)
+
+
+class SpatialHash:
+    """Uniform grid broadphase for Rects.
+
+    Each object is bucketed into every cell its rect overlaps, so two objects can
+    only collide if they share a cell. `nearby()` returns those candidates in the
+    order they were inserted so collision callbacks fire in a stable order.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}  # id(obj) -> (order, cells)
+        self.next_order = 0
+
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+        self.next_order = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __contains__(self, obj):
+        return id(obj) in self.entries
+
+
+    def cells_for(self, rect):
+        size = self.cell_size
+        left = int(rect.left // size)
+        top = int(rect.top // size)
+        right = int((rect.left + max(rect.width, 1) - 1) // size)
+        bottom = int((rect.top + max(rect.height, 1) - 1) // size)
+        return tuple((cx, cy) for cx in range(left, right + 1) for cy in range(top, bottom + 1))
+
+
+    def insert(self, obj):
+        if id(obj) in self.entries:
+            self.update(obj)
+            return
+        cells = self.cells_for(obj)
+        self.entries[id(obj)] = (self.next_order, cells)
+        self.next_order += 1
+        for cell in cells:
+            self.cells.setdefault(cell, {})[id(obj)] = obj
+
+
+    def remove(self, obj):
+        entry = self.entries.pop(id(obj), None)
+        if entry is None: return False
+        for cell in entry[1]:
+            bucket = self.cells[cell]
+            del bucket[id(obj)]
+            if not bucket:
+                del self.cells[cell]
+        return True
+
+
+    def update(self, obj):
+        """Re-bucket an object after it moved, keeping its insertion order."""
+        entry = self.entries.get(id(obj))
+        if entry is None: return
+        order, old_cells = entry
+        new_cells = self.cells_for(obj)
+        if new_cells == old_cells: return
+
+        for cell in old_cells:
+            bucket = self.cells[cell]
+            del bucket[id(obj)]
+            if not bucket:
+                del self.cells[cell]
+        for cell in new_cells:
+            self.cells.setdefault(cell, {})[id(obj)] = obj
+        self.entries[id(obj)] = (order, new_cells)
+
+
+    def nearby(self, rect):
+        """Objects sharing at least one cell with `rect`, in insertion order."""
+        found = {}
+        for cell in self.cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                found.update(bucket)
+        if len(found) < 2:
+            return list(found.values())
+        entries = self.entries
+        return sorted(found.values(), key=lambda obj: entries[id(obj)][0])
+
+
+class LayeredSpatialHash:
+    """A SpatialHash per CollisionLayer, so objects only meet the layers they collide with.
+
+    `matrix` maps each layer to the layers it collides with, and has to be symmetric.
+    Objects are bucketed by their `collision_layer` and `nearby()` only looks in the
+    grids of the layers that collides with, so pairs the matrix rules out, like two
+    enemies, are never tested at all.
+    """
+
+    def __init__(self, cell_size, matrix):
+        for layer, others in matrix.items():
+            for other in CollisionLayer:
+                if other in others and layer not in matrix.get(other, CollisionLayer(0)):
+                    raise ValueError(f'{layer} collides with {other} but not the other way round')
+        self.cell_size = cell_size
+        self.grids = {layer: SpatialHash(cell_size) for layer in CollisionLayer}
+        self.targets = {layer: [self.grids[other] for other in CollisionLayer if other in matrix.get(layer, CollisionLayer(0))]
+                        for layer in CollisionLayer}
+
+
+    def clear(self):
+        for grid in self.grids.values():
+            grid.clear()
+
+
+    def __len__(self):
+        return sum(len(grid) for grid in self.grids.values())
+
+
+    def __contains__(self, obj):
+        return obj in self.grids[obj.collision_layer]
+
+
+    def insert(self, obj):
+        self.grids[obj.collision_layer].insert(obj)
+
+
+    def remove(self, obj):
+        return self.grids[obj.collision_layer].remove(obj)
+
+
+    def update(self, obj):
+        self.grids[obj.collision_layer].update(obj)
+
+
+    def nearby(self, obj, rect=None):
+        """Objects `obj` collides with sharing at least one cell with it, or with `rect`
+        if given, grouped by layer and in insertion order within a layer."""
+        if rect is None:
+            rect = obj
+        grids = self.targets[obj.collision_layer]
+        if len(grids) == 1:
+            return grids[0].nearby(rect)
+        found = []
+        for grid in grids:
+            if len(grid):
+                found.extend(grid.nearby(rect))
+        return found
+
+
+class RingBuffer:
+    """The last `size` numbers put into it.
+
+    Putting a value, the mean and the max are all O(1): a running total is kept for
+    the mean and a monotonic queue of candidates for the max. Percentiles sort the
+    window when asked for.
+    """
+
     def __init__(self, size):
-        self.arr = []
-        self.max_size = size
+        self.size = size
+        self.values = [0.0] * size
+        self.count = 0
+        self.next = 0
+        self.total = 0.0
+        self.puts = 0
+        self.max_candidates = deque()  # (put number, value), values decreasing
+
+
+    def __len__(self):
+        return self.count
 
 
     def put(self, value):
-        if len(self.arr) < self.max_size:
-            self.arr.append(value)
+        if self.count == self.size:
+            self.total -= self.values[self.next]
         else:
-            self.arr.pop(0)
-            self.arr.append(value)
+            self.count += 1
+        self.values[self.next] = value
+        self.total += value
+        self.next = (self.next + 1) % self.size
+        if self.next == 0:
+            # Resum once per lap so floating point error can't build up.
+            self.total = sum(self.values[:self.count])
+
+        candidates = self.max_candidates
+        while candidates and candidates[-1][1] <= value:
+            candidates.pop()
+        candidates.append((self.puts, value))
+        if candidates[0][0] <= self.puts - self.size:
+            candidates.popleft()
+        self.puts += 1
+
+
+    def as_list(self):
+        """The values from oldest to newest."""
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.next:] + self.values[:self.next]
+
+
+    def mean(self):
+        if self.count == 0: return 0.0
+        return self.total / self.count
+
+
+    def max(self):
+        if self.count == 0: return 0.0
+        return self.max_candidates[0][1]
+
+
+    def percentile(self, fraction):
+        """The nearest-rank value below which `fraction` of the values fall."""
+        if self.count == 0: return 0.0
+        ordered = sorted(self.values[:self.count])
+        return ordered[min(self.count - 1, int(round(fraction * (self.count - 1))))]